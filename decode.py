@@ -1,24 +1,87 @@
 import click
-import numpy as np
-from decode.ilp import solve_library
-from decode.seq_utils import *
+import csv
+import os
 import time
 import json
 
-@click.command()
+# Solver backends of decode.backends.SOLVERS. The decode modules are only
+# imported by the commands that use them, so that --help and argument
+# errors do not wait for numpy, scipy, Biopython and the solvers
+SOLVERS = ['gurobi', 'highs', 'cpsat']
+
+class DefaultGroup(click.Group):
+    # Run the optimize command unless another command is named, so that
+    # `python decode.py --limit ...` keeps working
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands and args[0] not in ctx.help_option_names:
+            args.insert(0, 'optimize')
+        return super().parse_args(ctx, args)
+
+
+@click.group(cls=DefaultGroup)
+def cli():
+    """Degenerate codon design for complete protein-coding DNA libraries."""
+
+
+@cli.command('optimize')
 @click.argument('alignment_file', required=True, type=click.Path(exists=True, dir_okay=False, readable=True))
 @click.argument('output_file', required=True, type=click.Path(exists=False, dir_okay=False, readable=True))
 @click.option('--limit', required=True, type=int, prompt='Total lib size limit', help='Total library size limit.')
 @click.option('--sublib', required=True, type=int, prompt='Sublibrary limit', help='Total sublibrary limit')
 @click.option('--bins', default=100, show_default=True, help='Specify the number of bins for approximation of multi-sublibrary optimizations.')
+@click.option('--size-model', default='bins', show_default=True, type=click.Choice(['bins', 'log', 'pwl']), help='Approximate multi-sublibrary size with one binary per bin, log2(bins) binaries, or a piecewise linear size without binaries.')
+@click.option('--refine', is_flag=True, default=False, help='Re-solve multi-sublibrary designs with bins concentrated around the sublibrary sizes until the binned library size is exact within --refine-tolerance.')
+@click.option('--refine-tolerance', default=0.01, show_default=True, help='Relative tolerance of the refined library size.')
 @click.option('--time-limit', default=0, show_default=True, help='Time limit in seconds for the ILP solver.')
 @click.option('--threads', default=0, show_default=True, help='Time limit in seconds for the ILP solver.')
+@click.option('--solver', default='gurobi', show_default=True, type=click.Choice(list(SOLVERS)), help='MILP solver backend.')
+@click.option('--warm-start', default='greedy', show_default=True, type=click.Choice(['none', 'greedy']), help='Start the solver from a greedily constructed library.')
+@click.option('--symmetry', default='none', show_default=True, type=click.Choice(['none', 'size', 'target']), help='Break the symmetry between sublibraries by ordering them by size or by their first assigned target.')
+@click.option('--mode', default='ilp', show_default=True, type=click.Choice(['ilp', 'heuristic', 'decompose']), help='Solve the ILP, run a beam search without building the ILP (for very large target sets), or solve one single-sublibrary ILP per cluster of targets (for many sublibraries).')
+@click.option('--beam-width', default=8, show_default=True, help='Beam width of the heuristic mode.')
+@click.option('--repair', is_flag=True, default=False, help='Start the full ILP from the decomposed library.')
+@click.option('--repair-time-limit', default=60, show_default=True, help='Time limit in seconds for the repair ILP.')
+@click.option('--progress', default=None, type=click.File('w', lazy=True), help='Stream the solver progress (time, incumbent, bound, gap and nodes) to a file as newline-delimited JSON while the ILP is solved.')
+@click.option('--profile', is_flag=True, default=False, help='Record the time and peak memory of every phase of the run in the output file.')
+@click.option('--profile-dump', default=None, type=click.Path(dir_okay=False, writable=True), help='Write cProfile statistics of the run to a file.')
+@click.option('--export-model', default=None, type=click.Path(dir_okay=False, writable=True), help='Write the ILP to an MPS or LP file (by its extension, optionally .gz) and its column map to the same name with .json appended, to solve it again with solve-model.')
+@click.option('--export-only', is_flag=True, default=False, help='Only write the model of --export-model, without solving it or writing OUTPUT_FILE.')
 @click.option('-q', '--quiet', is_flag=True, default=False, show_default=True, help='Run quietly.')
 
 
-def optimize_lib(alignment_file, output_file, limit, sublib, bins, time_limit, threads, quiet):
+def optimize_lib(alignment_file, output_file, limit, sublib, bins, size_model, refine, refine_tolerance, time_limit, threads, solver, warm_start, symmetry, mode, beam_width, repair, repair_time_limit, progress, profile, profile_dump, export_model, export_only, quiet):
     """Optimize a degenerate codon library given a set of target sequences, a total size limit, and a sublibrary count limit."""
     
+    if export_only and export_model is None:
+        raise click.UsageError('--export-only requires --export-model.')
+    
+    if export_model is not None and (mode != 'ilp' or (refine and sublib > 1)):
+        raise click.UsageError('--export-model only applies to the ILP mode without --refine.')
+    
+    # The refined bins are a custom bin grid, which only the bins size model
+    # supports
+    if refine and sublib > 1 and size_model != 'bins':
+        raise click.UsageError('--refine requires --size-model bins.')
+    
+    # The log and pwl size models have continuous variables, which CP-SAT
+    # does not support
+    if solver == 'cpsat' and mode != 'heuristic' and sublib > 1 and size_model != 'bins':
+        raise click.UsageError('--solver cpsat requires --size-model bins.')
+    
+    from decode import profiling
+    
+    # Start profiling before the heavy imports, so that they count towards
+    # the total time and memory
+    if profile:
+        profiling.start()
+    
+    if profile_dump is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    
+    from decode.seq_utils import process_msa, create_O, library_output
+    
     if quiet:
         verbose = False
     else: verbose=True
@@ -27,7 +90,7 @@ def optimize_lib(alignment_file, output_file, limit, sublib, bins, time_limit, t
         click.echo('Reading MSA file...')
     
     # Read the MSA file
-    fixed_positions, variable_positions, sequences = process_msa(alignment_file, 'clustal')
+    fixed_positions, variable_positions, sequences = process_msa(alignment_file)
     
     if not quiet:
         click.echo('Removing fixed positions...')
@@ -43,66 +106,324 @@ def optimize_lib(alignment_file, output_file, limit, sublib, bins, time_limit, t
         click.echo('Number of variable positions:\t{}'.format(n_var_pos))
         click.echo('')
     
+    stream_progress = progress_writer(progress)
+    
     # Start timing
     start = time.time()
     
-    # Get the ILP solver solution
-    solution = solve_library(O, limit, sublib, bins=bins, verbose=verbose, time_limit=time_limit, threads=threads)
+    # Get the ILP solver or heuristic solution
+    # The heuristic and the decomposition (whose cluster ILPs run in other
+    # processes) are profiled as a single solve phase
+    try:
+        if mode == 'heuristic':
+            from decode.heuristic import solve_heuristic
+            with profiling.phase('solve'):
+                solution = solve_heuristic(O, limit, sublib, width=beam_width, verbose=verbose)
+        elif mode == 'decompose':
+            from decode.decompose import solve_decomposed
+            with profiling.phase('solve'):
+                solution = solve_decomposed(O, limit, sublib, verbose=verbose, cores=threads or None, repair=repair,
+                                            repair_time_limit=repair_time_limit, bins=bins, time_limit=time_limit,
+                                            solver=solver, warm_start=warm_start, symmetry=symmetry,
+                                            size_model=size_model)
+        elif refine and sublib > 1:
+            from decode.refine import solve_refined
+            solution = solve_refined(O, limit, sublib, bins=bins, tolerance=refine_tolerance, verbose=verbose,
+                                     time_limit=time_limit, threads=threads, solver=solver, warm_start=warm_start,
+                                     symmetry=symmetry, progress=stream_progress)
+        else:
+            from decode.ilp import solve_library
+            
+            # The column map of an exported model holds the alignment, so that
+            # solve-model can write the output file
+            export_info = {'fixed_positions': fixed_positions, 'variable_positions': variable_positions,
+                           'sequences': sequences, 'limit': limit, 'sublib': sublib}
+            
+            solution = solve_library(O, limit, sublib, bins=bins, verbose=verbose, time_limit=time_limit,
+                                     threads=threads, solver=solver, warm_start=warm_start, symmetry=symmetry,
+                                     size_model=size_model, progress=stream_progress, export=export_model,
+                                     export_info=export_info, export_only=export_only)
+    except RuntimeError as e:
+        # e.g. no solution at the time limit
+        raise click.ClickException(str(e))
+    
+    if solution is None:
+        if not quiet:
+            click.echo('Wrote the model to {0} and its column map to {0}.json.'.format(export_model))
+        return
     
     # End timing
     end = time.time()
     
-    # Extract setup and solve times
-    total_time = end - start
-    solve_time = solution['problem'].solver_stats.solve_time
-    construct_time = total_time - solve_time
+    # Get library stats and generate the output
+    data = library_output(fixed_positions, variable_positions, sequences, solution, end - start)
+    
+    if profile_dump is not None:
+        profiler.disable()
+        profiler.dump_stats(profile_dump)
     
-    # Get library stats
-    n_covered = int(np.sum(solution['binary_coverage']))
-    codons = retrieve_codons(solution['codon_selection'])
-    total_lib_size = int(calc_num_seqs(codons))
-    on_target_p = calc_prob_on_target(sequences, codons)
+    if profile:
+        data['profile'] = profiling.stop()
     
     if not quiet:
-        click.echo('')
-        click.echo('Number of covered targets:\t{:d}'.format(n_covered))
-        click.echo('Total library size:\t\t{:d}'.format(total_lib_size))
-        click.echo('Probability on target:\t\t{:0.5f}'.format(on_target_p))
-        click.echo('')
+        echo_stats(data)
+        
+        if profile:
+            echo_profile(data['profile'])
+        
+        click.echo('Writing output...')
     
-    # Parse the library
-    total_seq_length = len(fixed_positions) + len(variable_positions)
-    parsed_lib = parse_lib(total_seq_length, fixed_positions, codons)
+    with open(output_file, 'w') as fp:
+        json.dump(data, fp)
+
 
+@cli.command('solve-model')
+@click.argument('model_file', required=True, type=click.Path(exists=True, dir_okay=False, readable=True))
+@click.argument('output_file', required=True, type=click.Path(exists=False, dir_okay=False, readable=True))
+@click.option('--time-limit', default=0, show_default=True, help='Time limit in seconds for the ILP solver.')
+@click.option('--threads', default=0, show_default=True, help='Number of threads for the ILP solver.')
+@click.option('--solver', default='gurobi', show_default=True, type=click.Choice(list(SOLVERS)), help='MILP solver backend.')
+@click.option('--warm-start', default='stored', show_default=True, type=click.Choice(['none', 'stored']), help='Start the solver from the warm start stored with the model.')
+@click.option('--progress', default=None, type=click.File('w', lazy=True), help='Stream the solver progress (time, incumbent, bound, gap and nodes) to a file as newline-delimited JSON while the ILP is solved.')
+@click.option('--profile', is_flag=True, default=False, help='Record the time and peak memory of every phase of the run in the output file.')
+@click.option('-q', '--quiet', is_flag=True, default=False, show_default=True, help='Run quietly.')
+
+
+def solve_model_lib(model_file, output_file, time_limit, threads, solver, warm_start, progress, profile, quiet):
+    """Solve a model written by optimize --export-model without building it, and write the same output file as optimize."""
+    
+    from decode import profiling
+    
+    if profile:
+        profiling.start()
+    
+    from decode.ilp import solve_model
+    from decode.seq_utils import library_output
+    
+    stream_progress = progress_writer(progress)
+    
+    start = time.time()
+    
+    try:
+        solution, column_map = solve_model(model_file, solver=solver, verbose=not quiet, time_limit=time_limit,
+                                           threads=threads, warm_start=warm_start == 'stored',
+                                           progress=stream_progress)
+    except (OSError, ValueError, RuntimeError) as e:
+        raise click.ClickException(str(e))
+    
+    end = time.time()
+    
+    if 'sequences' not in column_map:
+        raise click.ClickException('The column map of {} has no alignment to write the output with.'.format(model_file))
+    
+    # JSON turns the fixed positions into strings
+    fixed_positions = {int(j): aa for j, aa in column_map['fixed_positions'].items()}
+    data = library_output(fixed_positions, column_map['variable_positions'], column_map['sequences'], solution, end - start)
+    
+    if profile:
+        data['profile'] = profiling.stop()
+    
     if not quiet:
+        echo_stats(data)
+        
+        if profile:
+            echo_profile(data['profile'])
+        
         click.echo('Writing output...')
-
-    if solution['problem'].status == 'optimal':
-        solution_optimal = True
-
-    elif solution['problem'].status == 'optimal_inaccurate':
-        solution_optimal = False
-
-    # Generate and write the output
-    data = {
-        'solution_optimal': solution_optimal,
-        'fixed_positions': fixed_positions,
-        'variable_positions': variable_positions,
-        'sequences': sequences,
-        'coverage': list(solution['binary_coverage']),
-        'n_var_pos': n_var_pos,
-        'n_covered': n_covered,
-        'total_lib_size': total_lib_size,
-        'on_target_p': on_target_p,
-        'parsed_lib': parsed_lib,
-        'construct_time': construct_time,
-        'solve_time': solve_time,
-        'total_time': total_time
-    }
     
     with open(output_file, 'w') as fp:
         json.dump(data, fp)
+
+
+@cli.command('sweep')
+@click.argument('alignment_file', required=True, type=click.Path(exists=True, dir_okay=False, readable=True))
+@click.argument('output_dir', required=True, type=click.Path(file_okay=False, writable=True))
+@click.option('--limit', required=True, type=int, multiple=True, help='Total library size limit (repeat for several limits).')
+@click.option('--sublib', required=True, type=int, multiple=True, help='Total sublibrary limit (repeat for several limits).')
+@click.option('--bins', default=100, show_default=True, help='Specify the number of bins for approximation of multi-sublibrary optimizations.')
+@click.option('--size-model', default='bins', show_default=True, type=click.Choice(['bins', 'log', 'pwl']), help='Approximate multi-sublibrary size with one binary per bin, log2(bins) binaries, or a piecewise linear size without binaries.')
+@click.option('--time-limit', default=0, show_default=True, help='Time limit in seconds for each ILP solve.')
+@click.option('--threads', default=0, show_default=True, help='Number of threads for the ILP solver.')
+@click.option('--solver', default='gurobi', show_default=True, type=click.Choice(list(SOLVERS)), help='MILP solver backend.')
+@click.option('--warm-start', default='greedy', show_default=True, type=click.Choice(['none', 'greedy']), help='Also start the solver from a greedily constructed library.')
+@click.option('--symmetry', default='none', show_default=True, type=click.Choice(['none', 'size', 'target']), help='Break the symmetry between sublibraries by ordering them by size or by their first assigned target.')
+@click.option('-q', '--quiet', is_flag=True, default=False, show_default=True, help='Run quietly.')
+
+
+def sweep_lib(alignment_file, output_dir, limit, sublib, bins, size_model, time_limit, threads, solver, warm_start, symmetry, quiet):
+    """Optimize libraries over a grid of total size limits and sublibrary count limits, writing one output file per grid point and a summary CSV."""
+    
+    # The log and pwl size models have continuous variables, which CP-SAT
+    # does not support
+    if solver == 'cpsat' and max(sublib) > 1 and size_model != 'bins':
+        raise click.UsageError('--solver cpsat requires --size-model bins.')
+    
+    from decode.seq_utils import process_msa, create_O, library_output
+    from decode.sweep import sweep_library
+    
+    verbose = not quiet
+    
+    if not quiet:
+        click.echo('Reading MSA file...')
+    
+    # Read the MSA file once for the whole grid
+    fixed_positions, variable_positions, sequences = process_msa(alignment_file)
+    n_targets, n_var_pos, O = create_O(sequences)
+    
+    os.makedirs(output_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(alignment_file))[0]
+    
+    summary = [['lib_limit', 'sublibs', 'n_covered', 'total_lib_size', 'on_target_p',
+                'solution_optimal', 'construct_time', 'solve_time', 'total_time']]
+    
+    start = time.time()
+    
+    for lib_lim, n_templates, solution in sweep_library(O, limit, sublib, bins=bins, verbose=verbose,
+                                                        time_limit=time_limit, threads=threads,
+                                                        solver=solver, warm_start=warm_start,
+                                                        symmetry=symmetry, size_model=size_model):
+        end = time.time()
+        data = library_output(fixed_positions, variable_positions, sequences, solution, end - start)
+        
+        if not quiet:
+            echo_stats(data)
+        
+        with open(os.path.join(output_dir, '{}_{}_{}.json'.format(name, lib_lim, n_templates)), 'w') as fp:
+            json.dump(data, fp)
+        
+        summary.append([lib_lim, n_templates, data['n_covered'], data['total_lib_size'], data['on_target_p'],
+                        data['solution_optimal'], data['construct_time'], data['solve_time'], data['total_time']])
+        
+        start = time.time()
+    
+    with open(os.path.join(output_dir, '{}_sweep.csv'.format(name)), 'w') as results_file:
+        writer = csv.writer(results_file)
+        writer.writerows(summary)
+
+
+@cli.command('batch')
+@click.argument('manifest', required=True, type=click.Path(exists=True, dir_okay=False, readable=True))
+@click.option('--cache-dir', default='.decode_cache', show_default=True, type=click.Path(file_okay=False, writable=True), help='Directory of cached results.')
+@click.option('--summary', default=None, type=click.Path(dir_okay=False, writable=True), help='Write a CSV summary of all jobs.')
+@click.option('--cores', default=0, show_default=True, help='Number of cores to divide between jobs (0 for all).')
+@click.option('--jobs', default=0, show_default=True, help='Number of jobs to run at once (0 for one per core).')
+@click.option('--solver', default='gurobi', show_default=True, type=click.Choice(list(SOLVERS)), help='MILP solver backend.')
+@click.option('--warm-start', default='greedy', show_default=True, type=click.Choice(['none', 'greedy']), help='Start the solver from a greedily constructed library.')
+@click.option('-q', '--quiet', is_flag=True, default=False, show_default=True, help='Run quietly.')
+
+
+def batch_lib(manifest, cache_dir, summary, cores, jobs, solver, warm_start, quiet):
+    """Optimize the libraries listed in a CSV manifest on a process pool, skipping jobs with a cached result."""
+    
+    from decode.batch import read_manifest, run_batch
+    
+    try:
+        job_list = read_manifest(manifest)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    
+    cache_files, errors = run_batch(job_list, cache_dir, cores=cores or None, n_workers=jobs or None,
+                                    solver=solver, warm_start=warm_start, verbose=not quiet)
+    
+    if summary is not None:
+        results = [['alignment', 'lib_limit', 'sublibs', 'bins', 'time_limit', 'n_covered', 'total_lib_size',
+                    'solution_optimal', 'total_time', 'result']]
+        
+        for job, cache_file in zip(job_list, cache_files):
+            row = [job['alignment'], job['limit'], job['sublib'], job['bins'], job['time_limit']]
+            
+            if cache_file is not None and os.path.exists(cache_file):
+                with open(cache_file, 'r') as fp:
+                    data = json.load(fp)
+                row += [data['n_covered'], data['total_lib_size'], data['solution_optimal'], data['total_time'], cache_file]
+            else:
+                row += ['NA', 'NA', 'NA', 'NA', 'NA']
+                
+            results.append(row)
+        
+        with open(summary, 'w') as results_file:
+            writer = csv.writer(results_file)
+            writer.writerows(results)
+    
+    # Exit non-zero if any job failed, once the other results are written
+    failed = ['{} limit={} sublib={}: {}'.format(job['alignment'], job['limit'], job['sublib'], error)
+              for job, error in zip(job_list, errors) if error is not None]
+    
+    if failed:
+        raise click.ClickException('{} of {} jobs failed:\n{}'.format(len(failed), len(job_list), '\n'.join(failed)))
+
+
+@cli.command('sample')
+@click.argument('library_file', required=True, type=click.Path(exists=True, dir_okay=False, readable=True))
+@click.option('--draws', default=1000000, show_default=True, help='Number of variants drawn from the library, e.g. the number of transformants.')
+@click.option('--fasta', default=None, type=click.Path(dir_okay=False, writable=True), help='Write the drawn variants to an aligned FASTA file.')
+@click.option('--stats', default=None, type=click.Path(dir_okay=False, writable=True), help='Write the statistics and the expected residue frequencies to a JSON file.')
+@click.option('--batch-size', default=1000000, show_default=True, help='Number of variants drawn at once.')
+@click.option('--seed', default=None, type=int, help='Random seed.')
+@click.option('-q', '--quiet', is_flag=True, default=False, show_default=True, help='Run quietly.')
+
+
+def sample_lib(library_file, draws, fasta, stats, batch_size, seed, quiet):
+    """Compute the expected diversity of a designed library for a transformation of --draws variants, and optionally draw the variants."""
+    
+    from decode.sampler import library_stats, library_counts, sample_library, write_fasta
+    
+    with open(library_file, 'r') as fp:
+        data = json.load(fp)
+    
+    try:
+        results = library_stats(data, draws, batch_size=batch_size, seed=seed)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    
+    if not quiet:
+        click.echo('')
+        click.echo('Variants drawn:\t\t\t{:d}'.format(draws))
+        click.echo('Expected unique variants:\t{:0.1f}{}'.format(results['expected_unique'], '' if results['unique_exact'] else ' (sampled)'))
+        click.echo('Fraction on target:\t\t{:0.5f}'.format(results['on_target_fraction']))
+        click.echo('Expected targets drawn:\t\t{:0.1f} of {:d}'.format(results['expected_targets_drawn'], results['n_distinct_targets']))
+        click.echo('')
+    
+    if stats is not None:
+        with open(stats, 'w') as fp:
+            json.dump(results, fp)
+    
+    if fasta is not None:
+        with open(fasta, 'wb') as handle:
+            write_fasta(handle, sample_library(library_counts(data), draws, batch_size=batch_size, seed=seed), data)
+
+
+def progress_writer(handle):
+    # Write every progress point to handle as soon as the solver reports it
+    if handle is None:
+        return None
+    
+    def write(point):
+        handle.write(json.dumps(point) + '\n')
+        handle.flush()
+    
+    return write
+
+
+def echo_profile(profile):
+    click.echo('Phase\t\tCalls\tTime (s)\tPeak RSS (MB)\tPeak traced (MB)')
+    
+    for name, record in profile['phases'].items():
+        click.echo('{:<12}\t{:d}\t{:0.3f}\t\t{:0.1f}\t\t{:0.1f}'.format(
+            name, record['calls'], record['time'], record['peak_rss_mb'], record['peak_traced_mb']))
+    
+    click.echo('{:<12}\t\t{:0.3f}\t\t{:0.1f}\t\t{:0.1f}'.format(
+        'total', profile['total_time'], profile['peak_rss_mb'], profile['peak_traced_mb']))
+    click.echo('')
+
+
+def echo_stats(data):
+    click.echo('')
+    click.echo('Number of covered targets:\t{:d}'.format(data['n_covered']))
+    click.echo('Total library size:\t\t{:d}'.format(data['total_lib_size']))
+    click.echo('Probability on target:\t\t{:0.5f}'.format(data['on_target_p']))
+    click.echo('')
     
 if __name__ == '__main__':
-    optimize_lib()
+    cli()
     
\ No newline at end of file
@@ -0,0 +1,1013 @@
+import itertools
+import os
+import re
+import time
+import warnings
+import numpy as np
+from scipy import sparse
+from .profiling import phase
+
+# Bounds at or beyond this magnitude are infinite in MPS and LP files, as
+# in Gurobi and CPLEX
+INFINITY = 1e30
+
+class Model:
+    """A mixed integer linear program, stored as sparse arrays.
+
+    Maximizes c @ x subject to row_lb <= A @ x <= row_ub and
+    col_lb <= x <= col_ub, with x integer where integrality is 1.
+    """
+
+    def __init__(self):
+        self.n_vars = 0
+        self.col_lb = []
+        self.col_ub = []
+        self.integrality = []
+        self.blocks = []
+        self.row_lb = []
+        self.row_ub = []
+        self.c = None
+
+    def add_variables(self, shape, lb=0, ub=1, integer=True):
+        # Return the column indices of the new variables in the given shape
+        size = int(np.prod(shape))
+        idx = np.arange(self.n_vars, self.n_vars + size).reshape(shape)
+
+        self.n_vars += size
+        self.col_lb.append(np.full(size, lb, dtype=float))
+        self.col_ub.append(np.full(size, ub, dtype=float))
+        self.integrality.append(np.full(size, int(integer)))
+
+        return idx
+
+    def add_constraints(self, terms, lb=-np.inf, ub=np.inf):
+        # Each term is a (coefficients, columns) pair, where coefficients
+        # is an (n_rows x len(columns)) matrix over the given columns
+        rows, cols, vals = [], [], []
+
+        for coef, columns in terms:
+            coef = sparse.coo_matrix(coef)
+            rows.append(coef.row)
+            cols.append(np.asarray(columns).reshape(-1)[coef.col])
+            vals.append(coef.data)
+            n_rows = coef.shape[0]
+
+        self.blocks.append((np.concatenate(rows), np.concatenate(cols), np.concatenate(vals), n_rows))
+        self.row_lb.append(np.broadcast_to(np.asarray(lb, dtype=float), n_rows))
+        self.row_ub.append(np.broadcast_to(np.asarray(ub, dtype=float), n_rows))
+
+    def set_objective(self, coef, columns):
+        # Variables added later get a zero objective coefficient
+        self.c = (np.asarray(columns).reshape(-1), np.asarray(coef, dtype=float).reshape(-1))
+
+    def arrays(self):
+        # Assemble the constraint matrix and bounds
+        rows, cols, vals = [], [], []
+        n_rows = 0
+
+        for block_rows, block_cols, block_vals, block_n_rows in self.blocks:
+            rows.append(block_rows + n_rows)
+            cols.append(block_cols)
+            vals.append(block_vals)
+            n_rows += block_n_rows
+
+        A = sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                              shape=(n_rows, self.n_vars))
+
+        c = np.zeros(self.n_vars)
+
+        if self.c is not None:
+            c[self.c[0]] = self.c[1]
+
+        return {
+            'A': A,
+            'row_lb': np.concatenate(self.row_lb),
+            'row_ub': np.concatenate(self.row_ub),
+            'c': c,
+            'col_lb': np.concatenate(self.col_lb),
+            'col_ub': np.concatenate(self.col_ub),
+            'integrality': np.concatenate(self.integrality)
+        }
+
+
+def is_feasible(arrays, x, tol=1e-6):
+    Ax = arrays['A'] @ x
+    return bool(np.all(Ax >= arrays['row_lb'] - tol) and np.all(Ax <= arrays['row_ub'] + tol) and
+                np.all(x >= arrays['col_lb'] - tol) and np.all(x <= arrays['col_ub'] + tol))
+
+
+def progress_point(solve_time, incumbent, bound, nodes):
+    # One point of the solver progress time series, with the relative gap
+    # between the incumbent and the bound as reported by Gurobi, which is
+    # undefined (None) without an incumbent or while it is 0
+    if incumbent is None or bound is None:
+        gap = None
+    elif incumbent == bound:
+        gap = 0.0
+    elif incumbent == 0:
+        gap = None
+    else:
+        gap = abs(bound - incumbent) / abs(incumbent)
+
+    return {
+        'time': float(solve_time),
+        'incumbent': None if incumbent is None else float(incumbent),
+        'bound': None if bound is None else float(bound),
+        'gap': gap,
+        'nodes': None if nodes is None else int(nodes)
+    }
+
+
+def solve(model, solver='gurobi', verbose=True, time_limit=0, threads=0, start=None, progress=None):
+    """Solve a Model (or its arrays) with the given backend.
+
+    If start is given, it is a feasible solution passed to the solver as
+    a MIP start, and returned instead of the solver's solution if that one
+    is worse (e.g. at the time limit, or if the solver cannot take a start).
+
+    If progress is given, it is called with a progress_point (time,
+    incumbent, bound, gap and nodes explored) whenever the solver finds
+    a new incumbent or, at most once a second, improves its bound, and
+    once more with the final result. HiGHS offers no callback through
+    scipy, so only its final result is reported.
+
+    Returns a dictionary with the solution vector x, a status of
+    'optimal', 'optimal_inaccurate' (a feasible but not provably optimal
+    solution, e.g. at the time limit) or 'infeasible', the objective
+    value and bound, the number of nodes explored (None if the solver
+    does not report it) and the solve time in seconds.
+    """
+    if solver not in SOLVERS:
+        raise ValueError('Unknown solver {}, expected one of {}.'.format(solver, ', '.join(SOLVERS)))
+
+    arrays = model.arrays() if isinstance(model, Model) else model
+
+    if start is not None and not is_feasible(arrays, start):
+        warnings.warn('The MIP start is not a feasible solution and is ignored.')
+        start = None
+
+    result = SOLVERS[solver](arrays, verbose, time_limit, threads, start, progress)
+
+    if result['x'] is not None:
+        # Snap integer variables onto integers
+        integer = arrays['integrality'] == 1
+        result['x'][integer] = np.round(result['x'][integer])
+
+        # Never return a solution that violates the model, e.g. through
+        # the tolerances of the solver or the rounding of CP-SAT's
+        # coefficients, but fall back on the start
+        if not is_feasible(arrays, result['x']):
+            warnings.warn('The {} solver returned an infeasible solution, which is ignored.'.format(solver))
+            result['x'], result['objective'] = None, None
+            result['status'] = 'infeasible_solution'
+
+    if start is not None and (result['x'] is None or result['objective'] < arrays['c'] @ start):
+        result['x'] = start.astype(float)
+        result['objective'] = arrays['c'] @ start
+        result['status'] = 'optimal' if result['bound'] == result['objective'] else 'optimal_inaccurate'
+
+    if progress is not None:
+        progress(progress_point(result['solve_time'], result['objective'], result['bound'], result['nodes']))
+
+    if result['x'] is None:
+        raise RuntimeError('The {} solver returned no solution (status: {}).'.format(solver, result['status']))
+
+    return result
+
+
+def _gurobi_callback(progress, interval=1.0):
+    # Report every new incumbent, and bound improvements at most once
+    # every interval seconds
+    from gurobipy import GRB
+
+    last = {'time': -np.inf, 'incumbent': None, 'bound': None}
+
+    def callback(model, where):
+        if where == GRB.Callback.MIPSOL:
+            # The best objective is only updated with the new solution
+            # after the callback
+            incumbent = max(model.cbGet(GRB.Callback.MIPSOL_OBJBST), model.cbGet(GRB.Callback.MIPSOL_OBJ))
+            bound = model.cbGet(GRB.Callback.MIPSOL_OBJBND)
+            nodes = model.cbGet(GRB.Callback.MIPSOL_NODCNT)
+        elif where == GRB.Callback.MIP:
+            incumbent = model.cbGet(GRB.Callback.MIP_OBJBST)
+            bound = model.cbGet(GRB.Callback.MIP_OBJBND)
+            nodes = model.cbGet(GRB.Callback.MIP_NODCNT)
+        else:
+            return
+
+        runtime = model.cbGet(GRB.Callback.RUNTIME)
+        incumbent = None if abs(incumbent) >= GRB.INFINITY else incumbent
+        bound = None if abs(bound) >= GRB.INFINITY else bound
+
+        new_incumbent = incumbent is not None and incumbent != last['incumbent']
+        new_bound = bound is not None and bound != last['bound'] and runtime - last['time'] >= interval
+
+        if new_incumbent or new_bound:
+            last.update({'time': runtime, 'incumbent': incumbent, 'bound': bound})
+            progress(progress_point(runtime, incumbent, bound, nodes))
+
+    return callback
+
+
+def _solve_gurobi(arrays, verbose, time_limit, threads, start, progress=None):
+    import gurobipy as gp
+    from gurobipy import GRB
+
+    with phase('canonicalize'):
+        m = gp.Model()
+        m.Params.OutputFlag = int(verbose)
+
+        if time_limit > 0:
+            m.Params.TimeLimit = time_limit
+
+        if threads > 0:
+            m.Params.Threads = threads
+
+        vtype = np.where(arrays['integrality'] == 1, GRB.INTEGER, GRB.CONTINUOUS)
+        x = m.addMVar(len(arrays['c']), lb=arrays['col_lb'], ub=arrays['col_ub'], vtype=vtype)
+        m.setObjective(arrays['c'] @ x, GRB.MAXIMIZE)
+
+        if start is not None:
+            x.Start = start
+
+        A, row_lb, row_ub = arrays['A'], arrays['row_lb'], arrays['row_ub']
+        equal = row_lb == row_ub
+        upper = ~equal & np.isfinite(row_ub)
+        lower = ~equal & np.isfinite(row_lb)
+
+        for rows, sense, rhs in [(equal, '=', row_ub), (upper, '<', row_ub), (lower, '>', row_lb)]:
+            if np.any(rows):
+                m.addMConstr(A[rows], x, sense, rhs[rows])
+
+        # Gurobi adds the variables and constraints lazily
+        m.update()
+
+    with phase('solve'):
+        if progress is not None:
+            m.optimize(_gurobi_callback(progress))
+        else:
+            m.optimize()
+
+    if m.Status == GRB.OPTIMAL:
+        status = 'optimal'
+    elif m.Status == GRB.INFEASIBLE:
+        status = 'infeasible'
+    elif m.SolCount > 0:
+        status = 'optimal_inaccurate'
+    else:
+        status = 'no_solution'
+
+    return {
+        'x': x.X if m.SolCount > 0 else None,
+        'status': status,
+        'objective': m.ObjVal if m.SolCount > 0 else None,
+        'bound': m.ObjBound,
+        'nodes': m.NodeCount,
+        'solve_time': m.Runtime
+    }
+
+
+def _solve_highs(arrays, verbose, time_limit, threads, start, progress=None):
+    # scipy's milp takes no MIP start or callback, so a start is only used
+    # by solve as a fallback solution, and progress only gets the result
+    from scipy.optimize import milp, LinearConstraint, Bounds
+
+    options = {'disp': verbose}
+
+    if time_limit > 0:
+        options['time_limit'] = time_limit
+
+    with phase('canonicalize'):
+        constraints = LinearConstraint(arrays['A'], arrays['row_lb'], arrays['row_ub'])
+        bounds = Bounds(arrays['col_lb'], arrays['col_ub'])
+
+    start_time = time.time()
+
+    with phase('solve'):
+        res = milp(-arrays['c'], constraints=constraints, integrality=arrays['integrality'], bounds=bounds,
+                   options=options)
+
+    solve_time = time.time() - start_time
+
+    if res.status == 0:
+        status = 'optimal'
+    elif res.status == 2:
+        status = 'infeasible'
+    elif res.x is not None:
+        status = 'optimal_inaccurate'
+    else:
+        status = 'no_solution'
+
+    return {
+        'x': res.x,
+        'status': status,
+        'objective': -res.fun if res.x is not None else None,
+        'bound': -res.mip_dual_bound if getattr(res, 'mip_dual_bound', None) is not None else None,
+        'nodes': getattr(res, 'mip_node_count', None),
+        'solve_time': solve_time
+    }
+
+
+def _integer_rows(A, rhs, upper, col_lb, col_ub, digits=10, tol=1e-6):
+    # CP-SAT only accepts integer coefficients, so scale every row with
+    # fractional coefficients to keep about `digits` significant digits
+    # of its largest coefficient. The scaled coefficients are rounded
+    # towards the bound (up in upper bound rows for nonnegative columns),
+    # so that every integer solution satisfies the original row within
+    # the tolerance of is_feasible. Coefficients of columns that can take
+    # both signs are rounded to the nearest integer, which solve checks
+    A = sparse.csr_matrix(A)
+    scale = np.ones(A.shape[0])
+
+    for r in range(A.shape[0]):
+        row = A.data[A.indptr[r]:A.indptr[r + 1]]
+        if len(row) and np.any(row != np.round(row)):
+            scale[r] = 10.0 ** max(0, digits - int(np.ceil(np.log10(np.max(np.abs(row))))))
+
+    A_int = sparse.csr_matrix(sparse.diags(scale) @ A)
+    sign = np.where(col_lb[A_int.indices] >= 0, 1, np.where(col_ub[A_int.indices] <= 0, -1, 0))
+    sign = sign if upper else -sign
+    A_int.data = np.where(sign > 0, np.ceil(A_int.data), np.where(sign < 0, np.floor(A_int.data), np.round(A_int.data)))
+
+    if upper:
+        rhs = np.floor((rhs + tol) * scale)
+    else:
+        rhs = np.ceil((rhs - tol) * scale)
+
+    return A_int.astype(np.int64), rhs.astype(np.int64)
+
+
+def _cpsat_callbacks(progress, interval=1.0):
+    # A solution callback reporting every new incumbent, and a bound
+    # callback reporting bound improvements at most once every interval
+    # seconds
+    from ortools.sat.python import cp_model
+
+    last = {'start': time.time(), 'time': -np.inf, 'incumbent': None}
+
+    class SolutionCallback(cp_model.CpSolverSolutionCallback):
+        def on_solution_callback(self):
+            last['incumbent'] = self.ObjectiveValue()
+            progress(progress_point(time.time() - last['start'], last['incumbent'], self.BestObjectiveBound(),
+                                    self.NumBranches()))
+
+    def bound_callback(bound):
+        runtime = time.time() - last['start']
+
+        if runtime - last['time'] >= interval:
+            last['time'] = runtime
+            progress(progress_point(runtime, last['incumbent'], bound, None))
+
+    return SolutionCallback(), bound_callback
+
+
+def _solve_cpsat(arrays, verbose, time_limit, threads, start, progress=None):
+    from ortools.sat.python import cp_model
+
+    if np.any(arrays['integrality'] == 0):
+        raise ValueError('The cpsat solver only supports integer variables.')
+
+    with phase('canonicalize'):
+        m = cp_model.CpModel()
+        x = [m.NewIntVar(int(lb), int(ub), '') for lb, ub in zip(arrays['col_lb'], arrays['col_ub'])]
+
+        for bound, upper in [(arrays['row_ub'], True), (arrays['row_lb'], False)]:
+            rows = np.abs(bound) < INFINITY
+            A_int, rhs = _integer_rows(arrays['A'][rows], bound[rows], upper, arrays['col_lb'], arrays['col_ub'])
+
+            for r in range(A_int.shape[0]):
+                cols = A_int.indices[A_int.indptr[r]:A_int.indptr[r + 1]]
+                coefs = A_int.data[A_int.indptr[r]:A_int.indptr[r + 1]]
+                expression = cp_model.LinearExpr.WeightedSum([x[j] for j in cols], [int(a) for a in coefs])
+
+                if upper:
+                    m.Add(expression <= int(rhs[r]))
+                else:
+                    m.Add(expression >= int(rhs[r]))
+
+        if start is not None:
+            for v, value in zip(x, start):
+                m.AddHint(v, int(value))
+
+        nonzero = np.flatnonzero(arrays['c'])
+        m.Maximize(cp_model.LinearExpr.WeightedSum([x[j] for j in nonzero], [int(a) for a in arrays['c'][nonzero]]))
+
+    solver = cp_model.CpSolver()
+    solver.parameters.log_search_progress = verbose
+
+    if time_limit > 0:
+        solver.parameters.max_time_in_seconds = time_limit
+
+    if threads > 0:
+        solver.parameters.num_workers = threads
+
+    with phase('solve'):
+        if progress is not None:
+            solution_callback, solver.best_bound_callback = _cpsat_callbacks(progress)
+            result = solver.Solve(m, solution_callback)
+        else:
+            result = solver.Solve(m)
+    has_solution = result in (cp_model.OPTIMAL, cp_model.FEASIBLE)
+
+    if result == cp_model.OPTIMAL:
+        status = 'optimal'
+    elif result == cp_model.INFEASIBLE:
+        status = 'infeasible'
+    elif has_solution:
+        status = 'optimal_inaccurate'
+    else:
+        status = 'no_solution'
+
+    return {
+        'x': np.array([solver.Value(v) for v in x], dtype=float) if has_solution else None,
+        'status': status,
+        'objective': solver.ObjectiveValue() if has_solution else None,
+        'bound': solver.BestObjectiveBound(),
+        'nodes': solver.NumBranches(),
+        'solve_time': solver.WallTime()
+    }
+
+
+def _number(value):
+    # Shortest text that reads back as the same float
+    return str(int(value)) if value.is_integer() and abs(value) < 1e15 else repr(value)
+
+
+def _numbers(values):
+    # Text of every value, formatting each distinct value once
+    unique, inverse = np.unique(values, return_inverse=True)
+    return np.array([_number(value) for value in unique.tolist()], dtype=object)[inverse.reshape(-1)]
+
+
+def _bound(value):
+    return _number(value) if abs(value) < INFINITY else ('-inf' if value < 0 else '+inf')
+
+
+def _model_format(filename):
+    name = filename[:-3] if filename.endswith('.gz') else filename
+    extension = os.path.splitext(name)[1].lower()
+
+    if extension not in ('.mps', '.lp'):
+        raise ValueError('Unknown model file {}, expected a .mps or .lp file (optionally .gz).'.format(filename))
+
+    return extension[1:]
+
+
+def _open_model(filename, mode):
+    # Open a model file as text, compressed if it ends in .gz
+    if filename.endswith('.gz'):
+        import gzip
+        return gzip.open(filename, mode + 't')
+
+    return open(filename, mode)
+
+
+def write_model(arrays, filename):
+    """Write the arrays of a Model to a free MPS or CPLEX LP file, chosen
+    by the extension of filename (.mps or .lp, optionally with .gz).
+
+    Column j is named xj and row i ri. MPS files keep every number
+    exactly. LP files split every row with two finite bounds into ri_lo
+    and ri_up, as Gurobi does not read ranged rows from LP files.
+    """
+    writer = _write_mps if _model_format(filename) == 'mps' else _write_lp
+
+    with _open_model(filename, 'w') as handle:
+        writer(arrays, handle)
+
+
+def _write_mps(arrays, handle):
+    A = sparse.csc_matrix(arrays['A'])
+    n_rows, n_cols = A.shape
+    row_lb, row_ub, c = arrays['row_lb'], arrays['row_ub'], arrays['c']
+
+    # Rows with an upper bound are L rows, with a range if they also have
+    # a lower bound. Free rows are written as N rows, which readers drop
+    equal = row_lb == row_ub
+    upper = ~equal & (row_ub < INFINITY)
+    lower = ~equal & ~upper & (row_lb > -INFINITY)
+    types = np.where(equal, 'E', np.where(upper, 'L', np.where(lower, 'G', 'N')))
+
+    handle.write('NAME decode\nOBJSENSE\n    MAX\nROWS\n N obj\n')
+    handle.writelines(map(' {} r{}\n'.format, types.tolist(), range(n_rows)))
+
+    # The entries of every column, with its objective coefficient first.
+    # Columns without coefficients are listed with their objective
+    counts = np.diff(A.indptr)
+    listed = np.flatnonzero((c != 0) | (counts == 0))
+    cols = np.concatenate([listed, np.repeat(np.arange(n_cols), counts)])
+    order = np.argsort(cols, kind='stable')
+    cols = cols[order]
+    rows = np.concatenate([np.full(len(listed), n_rows), A.indices])[order]
+    values = _numbers(np.concatenate([c[listed], A.data])[order])
+    row_names = np.array(['r{}'.format(i) for i in range(n_rows)] + ['obj'], dtype=object)[rows]
+
+    # Integer columns are listed between markers
+    integer = arrays['integrality'] == 1
+    edges = np.concatenate([[0], np.flatnonzero(np.diff(integer.astype(int))) + 1, [n_cols]])
+    starts = np.searchsorted(cols, edges)
+
+    handle.write('COLUMNS\n')
+
+    for k in range(len(edges) - 1):
+        entries = slice(starts[k], starts[k + 1])
+
+        if integer[edges[k]]:
+            handle.write("    MARKER 'MARKER' 'INTORG'\n")
+
+        handle.writelines(map('    x{} {} {}\n'.format, cols[entries].tolist(), row_names[entries].tolist(),
+                              values[entries].tolist()))
+
+        if integer[edges[k]]:
+            handle.write("    MARKER 'MARKER' 'INTEND'\n")
+
+    rhs = np.where(upper | equal, row_ub, row_lb)
+    written = np.flatnonzero((types != 'N') & (rhs != 0))
+    handle.write('RHS\n')
+    handle.writelines(map('    rhs r{} {}\n'.format, written.tolist(), _numbers(rhs[written]).tolist()))
+
+    ranged = np.flatnonzero(upper & (row_lb > -INFINITY))
+    handle.write('RANGES\n')
+    handle.writelines(map('    rng r{} {}\n'.format, ranged.tolist(), _numbers(row_ub[ranged] - row_lb[ranged]).tolist()))
+
+    # Every bound is written, as readers differ in the default bounds of
+    # integer columns
+    handle.write('BOUNDS\n')
+
+    for j, (lb, ub) in enumerate(zip(arrays['col_lb'].tolist(), arrays['col_ub'].tolist())):
+        if lb == ub:
+            handle.write(' FX bnd x{} {}\n'.format(j, _number(ub)))
+        elif lb <= -INFINITY and ub >= INFINITY:
+            handle.write(' FR bnd x{}\n'.format(j))
+        else:
+            if lb <= -INFINITY:
+                handle.write(' MI bnd x{}\n'.format(j))
+            elif lb != 0:
+                handle.write(' LO bnd x{} {}\n'.format(j, _number(lb)))
+
+            if ub >= INFINITY:
+                handle.write(' PL bnd x{}\n'.format(j))
+            else:
+                handle.write(' UP bnd x{} {}\n'.format(j, _number(ub)))
+
+    handle.write('ENDATA\n')
+
+
+def _lp_terms(columns, values):
+    # Text of the terms of a linear expression
+    return list(map(' {} {} x{}'.format, np.where(values < 0, '-', '+').tolist(), _numbers(np.abs(values)).tolist(),
+                    columns.tolist()))
+
+
+def _lp_lines(terms):
+    # Terms of an expression, ten to a line, as LP readers limit the length
+    # of lines
+    if not terms:
+        return ' 0 x0'
+
+    return '\n   '.join(''.join(terms[k:k + 10]) for k in range(0, len(terms), 10))
+
+
+def _write_lp(arrays, handle):
+    A = sparse.csr_matrix(arrays['A'])
+    row_lb, row_ub, c = arrays['row_lb'], arrays['row_ub'], arrays['c']
+
+    nonzero = np.flatnonzero(c)
+    handle.write('\\ DeCoDe library design ILP\nMaximize\n obj:')
+    handle.write(_lp_lines(_lp_terms(nonzero, c[nonzero])) + '\nSubject To\n')
+
+    terms = _lp_terms(A.indices, A.data)
+
+    for i, (lb, ub) in enumerate(zip(row_lb.tolist(), row_ub.tolist())):
+        expression = _lp_lines(terms[A.indptr[i]:A.indptr[i + 1]])
+
+        if lb == ub:
+            handle.write(' r{}:{} = {}\n'.format(i, expression, _number(ub)))
+        elif lb > -INFINITY and ub < INFINITY:
+            handle.write(' r{}_lo:{} >= {}\n'.format(i, expression, _number(lb)))
+            handle.write(' r{}_up:{} <= {}\n'.format(i, expression, _number(ub)))
+        elif ub < INFINITY:
+            handle.write(' r{}:{} <= {}\n'.format(i, expression, _number(ub)))
+        else:
+            handle.write(' r{}:{} >= {}\n'.format(i, expression, _number(max(lb, -INFINITY))))
+
+    handle.write('Bounds\n')
+
+    for j, (lb, ub) in enumerate(zip(arrays['col_lb'].tolist(), arrays['col_ub'].tolist())):
+        if lb == ub:
+            handle.write(' x{} = {}\n'.format(j, _number(ub)))
+        elif lb <= -INFINITY and ub >= INFINITY:
+            handle.write(' x{} free\n'.format(j))
+        else:
+            handle.write(' {} <= x{} <= {}\n'.format(_bound(lb), j, _bound(ub)))
+
+    integer = np.flatnonzero(arrays['integrality'] == 1).tolist()
+
+    if integer:
+        handle.write('Generals\n')
+        handle.writelines(''.join(' x{}'.format(j) for j in integer[k:k + 10]) + '\n'
+                          for k in range(0, len(integer), 10))
+
+    handle.write('End\n')
+
+
+def read_model(filename):
+    """Read an MPS or CPLEX LP file, chosen by the extension of filename
+    (.mps or .lp, optionally with .gz), as the arrays of a Model.
+
+    Minimization problems are negated into maximization problems, and
+    bounds at or beyond 1e30 are infinite. Returns the arrays and the
+    names of the columns, in the order they first appear in the file.
+    """
+    reader = _read_mps if _model_format(filename) == 'mps' else _read_lp
+
+    with _open_model(filename, 'r') as handle:
+        return reader(handle)
+
+
+def _new_model():
+    # Columns, rows and blocks of coefficients of a model as it is read
+    return {'columns': {}, 'col_lb': [], 'col_ub': [], 'integrality': [], 'row_lb': [], 'row_ub': [],
+            'entries': [], 'c': {}}
+
+
+def _columns(model, names, integer=False):
+    # Indices of the named columns, adding new columns with the default
+    # bounds in the order they first appear
+    columns = model['columns']
+    new = [name for name in dict.fromkeys(names) if name not in columns]
+    columns.update(zip(new, range(len(columns), len(columns) + len(new))))
+    idx = np.fromiter(map(columns.__getitem__, names), dtype=np.int64, count=len(names))
+    n_new = len(new)
+
+    model['col_lb'].extend([0.0] * n_new)
+    model['col_ub'].extend([np.inf] * n_new)
+    model['integrality'].extend([int(integer)] * n_new)
+
+    return idx
+
+
+def _model_arrays(model, maximize):
+    def infinite(values):
+        values = np.asarray(values, dtype=float)
+        return np.where(np.abs(values) >= INFINITY, np.copysign(np.inf, values), values)
+
+    n_cols = len(model['columns'])
+    rows, cols, vals = [np.concatenate([block[k] for block in model['entries']] + [np.zeros(0)]) for k in range(3)]
+    A = sparse.csr_matrix((vals, (rows.astype(np.int64), cols.astype(np.int64))), shape=(len(model['row_lb']), n_cols))
+
+    c = np.zeros(n_cols)
+    c[list(model['c'])] = list(model['c'].values())
+
+    arrays = {
+        'A': A,
+        'row_lb': infinite(model['row_lb']),
+        'row_ub': infinite(model['row_ub']),
+        'c': c if maximize else -c,
+        'col_lb': infinite(model['col_lb']),
+        'col_ub': infinite(model['col_ub']),
+        'integrality': np.array(model['integrality'], dtype=int)
+    }
+
+    return arrays, list(model['columns'])
+
+
+def _mps_entries(model, rows, names, row_names, values, integer):
+    # Add the (column, row, value) entries of the COLUMNS section of an
+    # MPS file. The objective is row -1 and dropped free rows are row -2
+    if not names:
+        return
+
+    cols = _columns(model, names, integer)
+
+    try:
+        idx = np.fromiter(map(rows.__getitem__, row_names), dtype=np.int64, count=len(row_names))
+    except KeyError as e:
+        raise ValueError('Coefficient in the unknown row {} of the MPS file.'.format(e.args[0]))
+
+    values = np.array(values, dtype=float)
+    objective = idx == -1
+    model['c'].update(zip(cols[objective].tolist(), values[objective].tolist()))
+
+    kept = idx >= 0
+    model['entries'].append((idx[kept], cols[kept], values[kept]))
+
+
+def _read_mps_columns(lines, model, rows, block_size=100000):
+    # Read the COLUMNS section of an MPS file in blocks of lines. Blocks
+    # whose lines all have a single coefficient are split at once, others
+    # line by line. Returns the lines read past the end of the section
+    integer = False
+
+    while True:
+        block = list(itertools.islice(lines, block_size))
+
+        if not block:
+            return []
+
+        text = ''.join(block)
+        fields = text.split()
+
+        # Lines that all start with a space hold no section header
+        if len(fields) == 3 * len(block) and 'MARKER' not in text and ('\n' + text).count('\n ') == len(block):
+            _mps_entries(model, rows, fields[0::3], fields[1::3], fields[2::3], integer)
+            continue
+
+        names, row_names, values = [], [], []
+
+        for k, line in enumerate(block):
+            if not line.strip() or line.startswith('*'):
+                continue
+
+            # The next section header ends the section
+            if not line[0].isspace():
+                _mps_entries(model, rows, names, row_names, values, integer)
+                return block[k:]
+
+            fields = line.split()
+
+            # Integer columns are listed between markers
+            if len(fields) >= 3 and fields[1].strip('\'"').upper() == 'MARKER':
+                _mps_entries(model, rows, names, row_names, values, integer)
+                names, row_names, values = [], [], []
+                integer = fields[2].strip('\'"').upper() == 'INTORG'
+                continue
+
+            for row_name, value in zip(fields[1::2], fields[2::2]):
+                names.append(fields[0])
+                row_names.append(row_name)
+                values.append(value)
+
+        _mps_entries(model, rows, names, row_names, values, integer)
+
+
+def _read_mps(handle):
+    model = _new_model()
+    rows, types, rhs, ranges = {}, [], {}, {}
+    objective, maximize = None, False
+    section = None
+    lines = iter(handle)
+
+    def pairs(fields):
+        # (name, value) pairs of a line, after the optional set name
+        fields = fields[1:] if len(fields) % 2 else fields
+        return zip(fields[::2], map(float, fields[1::2]))
+
+    for line in lines:
+        if not line.strip() or line.startswith('*'):
+            continue
+
+        fields = line.split()
+
+        # Section headers start in the first column
+        if not line[0].isspace():
+            section = fields[0].upper()
+
+            if section == 'OBJSENSE' and len(fields) > 1:
+                maximize = fields[1].upper() in ('MAX', 'MAXIMIZE')
+
+            if section == 'COLUMNS':
+                lines = itertools.chain(_read_mps_columns(lines, model, rows), lines)
+                break
+
+            continue
+
+        if section == 'OBJSENSE':
+            maximize = fields[0].upper() in ('MAX', 'MAXIMIZE')
+
+        elif section == 'ROWS':
+            kind, name = fields[0].upper(), fields[1]
+
+            # N rows after the objective are free rows, which are dropped
+            if kind == 'N':
+                objective = name if objective is None else objective
+                rows[name] = -1 if name == objective else -2
+            else:
+                rows[name] = len(types)
+                types.append(kind)
+
+    for line in lines:
+        if not line.strip() or line.startswith('*'):
+            continue
+
+        fields = line.split()
+
+        if not line[0].isspace():
+            section = fields[0].upper()
+
+        elif section in ('RHS', 'RANGES'):
+            for name, value in pairs(fields):
+                if rows.get(name, -1) >= 0:
+                    (rhs if section == 'RHS' else ranges)[rows[name]] = value
+
+        elif section == 'BOUNDS':
+            kind = fields[0].upper()
+
+            # The bound set name is optional
+            if kind in ('FR', 'MI', 'PL', 'BV'):
+                name, value = fields[2] if len(fields) > 2 else fields[1], None
+            else:
+                name, value = fields[-2], float(fields[-1])
+
+            j = _columns(model, [name])[0]
+
+            if kind in ('UP', 'UI'):
+                model['col_ub'][j] = value
+            if kind in ('LO', 'LI'):
+                model['col_lb'][j] = value
+            if kind == 'FX':
+                model['col_lb'][j] = model['col_ub'][j] = value
+            if kind in ('FR', 'MI'):
+                model['col_lb'][j] = -np.inf
+            if kind in ('FR', 'PL'):
+                model['col_ub'][j] = np.inf
+            if kind == 'BV':
+                model['col_lb'][j], model['col_ub'][j] = 0.0, 1.0
+            if kind in ('BV', 'LI', 'UI'):
+                model['integrality'][j] = 1
+
+    # Row bounds from the right hand sides and ranges
+    for i, kind in enumerate(types):
+        value, span = rhs.get(i, 0.0), ranges.get(i)
+
+        if kind == 'E':
+            lb, ub = (value, value) if span is None else sorted([value, value + span])
+        elif kind == 'L':
+            lb, ub = (-np.inf if span is None else value - abs(span)), value
+        else:
+            lb, ub = value, (np.inf if span is None else value + abs(span))
+
+        model['row_lb'].append(lb)
+        model['row_ub'].append(ub)
+
+    return _model_arrays(model, maximize)
+
+
+# Section keywords of LP files, which stand on lines of their own
+_LP_SECTIONS = {'maximize': 'maximize', 'maximise': 'maximize', 'maximum': 'maximize', 'max': 'maximize',
+                'minimize': 'minimize', 'minimise': 'minimize', 'minimum': 'minimize', 'min': 'minimize',
+                'subject to': 'constraints', 'such that': 'constraints', 'st': 'constraints',
+                's.t.': 'constraints', 'bounds': 'bounds', 'bound': 'bounds', 'general': 'general',
+                'generals': 'general', 'gen': 'general', 'integer': 'general', 'integers': 'general',
+                'binary': 'binary', 'binaries': 'binary', 'bin': 'binary', 'end': 'end'}
+
+_LP_SENSES = {'<': '<=', '<=': '<=', '=<': '<=', '>': '>=', '>=': '>=', '=>': '>=', '=': '='}
+
+_LP_SENSE = re.compile(r'=[<>]|[<>]=?|=')
+
+# An optional sign and coefficient, and the name of a column
+_LP_TERM = re.compile(r'([+-]?)\s*((?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)?\s*([^\s\d.+\-<>=:][^\s+\-<>=:]*)')
+
+_LP_LABEL = re.compile(r'^\s*[^\s:]+\s*:')
+
+
+def _lp_number(text):
+    try:
+        return float(text.replace(' ', ''))
+    except ValueError:
+        raise ValueError('{} is not a number in the LP file.'.format(text.strip()))
+
+
+def _is_lp_number(text):
+    try:
+        _lp_number(text)
+        return True
+    except ValueError:
+        return False
+
+
+def _lp_expression(model, text):
+    # Columns and coefficients of the terms of a linear expression
+    text = _LP_LABEL.sub('', text, count=1)
+    fields = text.split()
+
+    # Terms written as sign, coefficient and name, as by write_model and
+    # Gurobi, are split at once
+    try:
+        if len(fields) % 3 or not set(fields[0::3]) <= {'+', '-'}:
+            raise ValueError
+        signs, names = fields[0::3], fields[2::3]
+        values = np.array(fields[1::3], dtype=float)
+    except ValueError:
+        terms = _LP_TERM.findall(text)
+        signs, coefs, names = zip(*terms) if terms else ((), (), ())
+        values = np.array([coef or '1' for coef in coefs], dtype=float)
+
+    values[np.array(signs, dtype=object) == '-'] *= -1
+
+    return _columns(model, names), values
+
+
+def _lp_constraint(model, text):
+    # A constraint is its terms, a sense and a right hand side
+    parts = _LP_SENSE.split(text, maxsplit=1)
+    sense = _LP_SENSES[_LP_SENSE.search(text).group()]
+    rhs = _lp_number(parts[1])
+    cols, values = _lp_expression(model, parts[0])
+
+    model['entries'].append((np.full(len(cols), len(model['row_lb'])), cols, values))
+    model['row_lb'].append(rhs if sense != '<=' else -np.inf)
+    model['row_ub'].append(rhs if sense != '>=' else np.inf)
+
+
+def _lp_bound(model, line):
+    # name free, name sense value, value sense name, or
+    # value sense name sense value
+    fields = line.split()
+
+    if len(fields) == 2 and fields[1].lower() == 'free':
+        j = _columns(model, fields[:1])[0]
+        model['col_lb'][j], model['col_ub'][j] = -np.inf, np.inf
+        return
+
+    parts = [part.strip() for part in _LP_SENSE.split(line)]
+    senses = [_LP_SENSES[sense] for sense in _LP_SENSE.findall(line)]
+    flipped = {'<=': '>=', '>=': '<=', '=': '='}
+
+    if len(parts) == 2 and not _is_lp_number(parts[0]):
+        bounds = [(parts[0], senses[0], parts[1])]
+    elif len(parts) == 2:
+        bounds = [(parts[1], flipped[senses[0]], parts[0])]
+    elif len(parts) == 3:
+        bounds = [(parts[1], flipped[senses[0]], parts[0]), (parts[1], senses[1], parts[2])]
+    else:
+        raise ValueError('Cannot read the bound {} of the LP file.'.format(line.strip()))
+
+    for name, sense, value in bounds:
+        j = _columns(model, [name])[0]
+
+        if sense in ('>=', '='):
+            model['col_lb'][j] = _lp_number(value)
+        if sense in ('<=', '='):
+            model['col_ub'][j] = _lp_number(value)
+
+
+def _read_lp(handle):
+    model = _new_model()
+    maximize, section = False, None
+    statement = []
+
+    def objective():
+        cols, values = _lp_expression(model, ''.join(statement))
+
+        for j, value in zip(cols.tolist(), values.tolist()):
+            model['c'][j] = model['c'].get(j, 0.0) + value
+
+    for line in handle:
+        line = line.split('\\')[0]
+
+        if not line.strip():
+            continue
+
+        # Section keywords are short, which saves splitting long lines
+        header = _LP_SECTIONS.get(' '.join(line.split()).lower()) if len(line) < 32 else None
+
+        if header is not None:
+            if section in ('maximize', 'minimize'):
+                objective()
+            elif statement:
+                raise ValueError('Constraint without a sense in the LP file.')
+
+            statement = []
+            section = header
+            maximize = maximize or section == 'maximize'
+
+            if section == 'end':
+                break
+
+        elif section in ('maximize', 'minimize'):
+            statement.append(line)
+
+        # Constraints can span several lines, up to their sense
+        elif section == 'constraints':
+            statement.append(line)
+
+            if '<' in line or '>' in line or '=' in line:
+                _lp_constraint(model, ''.join(statement))
+                statement = []
+
+        elif section == 'bounds':
+            _lp_bound(model, line)
+
+        elif section in ('general', 'binary'):
+            for j in _columns(model, line.split(), integer=True).tolist():
+                model['integrality'][j] = 1
+
+                if section == 'binary':
+                    model['col_lb'][j], model['col_ub'][j] = 0.0, 1.0
+
+        else:
+            raise ValueError('Unexpected {} before the objective of the LP file.'.format(line.strip()))
+
+    if section in ('maximize', 'minimize'):
+        objective()
+
+    return _model_arrays(model, maximize)
+
+
+SOLVERS = {
+    'gurobi': _solve_gurobi,
+    'highs': _solve_highs,
+    'cpsat': _solve_cpsat
+}
@@ -0,0 +1,177 @@
+import csv
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from . import __version__
+
+# Manifest columns, with the defaults of the optional ones
+JOB_DEFAULTS = {
+    'alignment': None,
+    'limit': None,
+    'sublib': None,
+    'bins': 100,
+    'time_limit': 0,
+    'output': ''
+}
+
+
+def read_manifest(filename):
+    """Read a CSV manifest with one job per row.
+
+    The alignment, limit and sublib columns are required; bins,
+    time_limit and output (a path the result is copied to) are optional.
+    Relative alignment and output paths are taken relative to the manifest.
+    """
+    base_dir = os.path.dirname(os.path.abspath(filename))
+    jobs = []
+
+    with open(filename, 'r') as manifest_file:
+        for row in csv.DictReader(manifest_file):
+            job = dict(JOB_DEFAULTS)
+            job.update({key: value for key, value in row.items() if value not in (None, '')})
+
+            for key in ['alignment', 'limit', 'sublib']:
+                if job[key] is None:
+                    raise ValueError('Manifest row {} has no {}.'.format(len(jobs) + 1, key))
+
+            for key in ['limit', 'sublib', 'bins', 'time_limit']:
+                try:
+                    job[key] = int(float(job[key]))
+                except ValueError:
+                    raise ValueError('Manifest row {} has a non-numeric {}: {!r}.'.format(len(jobs) + 1, key, job[key]))
+
+            for key in ['alignment', 'output']:
+                if job[key]:
+                    job[key] = os.path.join(base_dir, job[key])
+
+            jobs.append(job)
+
+    return jobs
+
+
+def job_key(job, solver='gurobi', warm_start='greedy'):
+    # Hash of the alignment contents, the parameters that change the
+    # result and the package version
+    digest = hashlib.sha256()
+
+    with open(job['alignment'], 'rb') as handle:
+        digest.update(handle.read())
+
+    params = {key: job[key] for key in ['limit', 'sublib', 'bins', 'time_limit']}
+    params.update({'solver': solver, 'warm_start': warm_start, 'version': __version__})
+    digest.update(json.dumps(params, sort_keys=True).encode())
+
+    return digest.hexdigest()
+
+
+def run_job(job, cache_file, threads=0, solver='gurobi', warm_start='greedy'):
+    """Design the library of a single job and write its output file to
+    cache_file. Returns cache_file."""
+    # Only the worker processes import the solver code, so that a batch
+    # of cached jobs returns quickly
+    from .ilp import solve_library
+    from .seq_utils import process_msa, create_O, library_output
+
+    fixed_positions, variable_positions, sequences = process_msa(job['alignment'])
+    n_targets, n_var_pos, O = create_O(sequences)
+
+    start = time.time()
+
+    solution = solve_library(O, job['limit'], job['sublib'], bins=job['bins'], verbose=False,
+                             time_limit=job['time_limit'], threads=threads, solver=solver,
+                             warm_start=warm_start)
+
+    data = library_output(fixed_positions, variable_positions, sequences, solution, time.time() - start)
+
+    # Write to a temporary file first so that an interrupted job never
+    # leaves a partial result in the cache
+    with open(cache_file + '.tmp', 'w') as fp:
+        json.dump(data, fp)
+
+    os.replace(cache_file + '.tmp', cache_file)
+
+    return cache_file
+
+
+def run_batch(jobs, cache_dir, cores=None, n_workers=None, solver='gurobi', warm_start='greedy', verbose=True):
+    """Run the jobs that have no cached result on a process pool.
+
+    The cores are divided between the concurrent jobs, each of which
+    passes its share to the solver as its thread count. By default, as
+    many jobs as there are cores (or pending jobs) run at once.
+
+    Returns the cache file of every job (None if its alignment could not
+    be read) and the error message of every job (None if it succeeded),
+    in order.
+    """
+    cores = cores or os.cpu_count() or 1
+    os.makedirs(cache_dir, exist_ok=True)
+
+    # A job whose alignment cannot be read fails on its own, without
+    # stopping the others
+    cache_files = []
+    errors = []
+
+    for job in jobs:
+        try:
+            cache_files.append(os.path.join(cache_dir, job_key(job, solver, warm_start) + '.json'))
+            errors.append(None)
+        except OSError as e:
+            cache_files.append(None)
+            errors.append(str(e))
+
+            if verbose:
+                print('{} limit={} sublib={}: failed ({})'.format(os.path.basename(job['alignment']), job['limit'],
+                                                                 job['sublib'], e))
+
+    # Identical jobs only need to run once
+    pending = {}
+    failures = {}
+
+    for job, cache_file in zip(jobs, cache_files):
+        if cache_file is not None and not os.path.exists(cache_file):
+            pending.setdefault(cache_file, job)
+
+    if verbose:
+        n_cached = sum(cache_file is not None and os.path.exists(cache_file) for cache_file in cache_files)
+        print('{} of {} jobs cached, running {} distinct jobs.'.format(n_cached, len(jobs), len(pending)))
+
+    if pending:
+        n_workers = min(n_workers or cores, len(pending))
+        threads = max(1, cores // n_workers)
+
+        if verbose:
+            print('Running {} jobs at once with {} solver threads each.'.format(n_workers, threads))
+
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = {pool.submit(run_job, job, cache_file, threads, solver, warm_start): cache_file
+                       for cache_file, job in pending.items()}
+
+            for future in as_completed(futures):
+                cache_file = futures[future]
+                job = pending[cache_file]
+
+                try:
+                    future.result()
+                    status = 'done'
+                except Exception as e:
+                    failures[cache_file] = str(e)
+                    status = 'failed ({})'.format(e)
+
+                if verbose:
+                    print('{} limit={} sublib={}: {}'.format(os.path.basename(job['alignment']), job['limit'],
+                                                            job['sublib'], status))
+
+    errors = [failures.get(cache_file, error) for cache_file, error in zip(cache_files, errors)]
+
+    # Copy the results to the requested output files
+    for job, cache_file in zip(jobs, cache_files):
+        if job['output'] and cache_file is not None and os.path.exists(cache_file):
+            os.makedirs(os.path.dirname(job['output']), exist_ok=True)
+
+            with open(cache_file, 'r') as src, open(job['output'], 'w') as dst:
+                dst.write(src.read())
+
+    return cache_files, errors
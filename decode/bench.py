@@ -0,0 +1,128 @@
+import csv
+import json
+import platform
+import time
+import click
+import numpy as np
+from . import __version__, profiling
+
+# Columns of the CSV output, in order
+COLUMNS = ['n_targets', 'length', 'n_var_pos', 'sublib', 'limit', 'mode', 'solver', 'seed', 'generate_time',
+           'encode_time', 'build_time', 'warm_start_time', 'canonicalize_time', 'solve_time', 'total_time',
+           'rows', 'columns', 'nonzeros', 'peak_rss_mb', 'peak_traced_mb', 'status', 'objective', 'n_covered']
+
+
+def run_instance(n_targets, length, n_var_pos, sublib, limit, mode='ilp', solver='highs', time_limit=0,
+                 mutations=1, seed=0, trace=False):
+    """Generate a synthetic instance with seq_utils.generate_targets and
+    design its library, recording the time and peak memory of every phase
+    and the size of the ILP.
+
+    Returns a dictionary with the COLUMNS of the instance.
+    """
+    from .seq_utils import AA_CODES, generate_targets
+
+    start = time.perf_counter()
+    targets = generate_targets(n_targets, length, n_var_pos=n_var_pos, mutations=mutations, seed=seed)
+    generate_time = time.perf_counter() - start
+
+    profiling.start(trace=trace)
+
+    # Only the positions that vary between the targets are optimized
+    with profiling.phase('encode'):
+        O = AA_CODES[targets[:, np.any(targets != targets[0], axis=0)]]
+
+    if mode == 'heuristic':
+        from .heuristic import solve_heuristic
+        with profiling.phase('solve'):
+            solution = solve_heuristic(O, limit, sublib, verbose=False)
+    else:
+        from .ilp import solve_library
+        solution = solve_library(O, limit, sublib, verbose=False, solver=solver, time_limit=time_limit)
+
+    profile = profiling.stop()
+    phases = profile['phases']
+    model_size = solution.get('model_size', {})
+
+    record = {
+        'n_targets': n_targets,
+        'length': length,
+        'n_var_pos': O.shape[1],
+        'sublib': sublib,
+        'limit': limit,
+        'mode': mode,
+        'solver': solver if mode == 'ilp' else None,
+        'seed': seed,
+        'generate_time': generate_time,
+        'total_time': profile['total_time'],
+        'rows': model_size.get('rows'),
+        'columns': model_size.get('columns'),
+        'nonzeros': model_size.get('nonzeros'),
+        'peak_rss_mb': profile['peak_rss_mb'],
+        'peak_traced_mb': profile['peak_traced_mb'],
+        'status': solution['status'],
+        'objective': solution['objective'],
+        'n_covered': int(np.sum(solution['binary_coverage']))
+    }
+
+    for name in ['encode', 'build_model', 'warm_start', 'canonicalize', 'solve']:
+        key = 'build_time' if name == 'build_model' else name + '_time'
+        record[key] = phases[name]['time'] if name in phases else None
+
+    return {column: record[column] for column in COLUMNS}
+
+
+@click.command()
+@click.option('--targets', default=[100, 300, 1000], show_default=True, multiple=True, help='Number of targets (repeat for a ladder of sizes).')
+@click.option('--length', default=100, show_default=True, help='Length of the targets.')
+@click.option('--var-pos', default=20, show_default=True, help='Number of positions the targets are mutated at.')
+@click.option('--sublib', default=[1, 2], show_default=True, multiple=True, help='Sublibrary limit (repeat for several).')
+@click.option('--limit', default=1000000, show_default=True, help='Total library size limit.')
+@click.option('--mutations', default=1.0, show_default=True, help='Mean number of substitutions between a target and its parent.')
+@click.option('--mode', default='ilp', show_default=True, type=click.Choice(['ilp', 'heuristic']), help='Solve the ILP or run the beam search.')
+@click.option('--solver', default='highs', show_default=True, type=click.Choice(['gurobi', 'highs', 'cpsat']), help='MILP solver backend.')
+@click.option('--time-limit', default=30, show_default=True, help='Time limit in seconds for every solve.')
+@click.option('--repeats', default=1, show_default=True, help='Number of instances of every size, with consecutive seeds.')
+@click.option('--seed', default=0, show_default=True, help='Seed of the first instance.')
+@click.option('--trace-memory', is_flag=True, default=False, help='Also record the peak traced Python memory, which slows down the run.')
+@click.option('--json', 'json_file', default=None, type=click.Path(dir_okay=False, writable=True), help='Write the results and the environment to a JSON file.')
+@click.option('--csv', 'csv_file', default=None, type=click.Path(dir_okay=False, writable=True), help='Write the results to a CSV file.')
+def main(targets, length, var_pos, sublib, limit, mutations, mode, solver, time_limit, repeats, seed, trace_memory,
+         json_file, csv_file):
+    """Benchmark model construction and solving on synthetic instances over a ladder of sizes."""
+    results = []
+
+    for n_targets in targets:
+        for n_templates in sublib:
+            for repeat in range(repeats):
+                record = run_instance(n_targets, length, var_pos, n_templates, limit, mode=mode, solver=solver,
+                                      time_limit=time_limit, mutations=mutations, seed=seed + repeat,
+                                      trace=trace_memory)
+                results.append(record)
+
+                click.echo('{n_targets} targets, {n_var_pos} variable positions, {sublib} sublibraries: build '
+                           '{build_time:.3f} s, solve {solve_time:.3f} s, {rows} x {columns} with {nonzeros} '
+                           'nonzeros, peak RSS {peak_rss_mb:.1f} MB, {n_covered} covered ({status})'.format(
+                               **dict(record, build_time=record['build_time'] or 0.0)))
+
+    if json_file is not None:
+        environment = {
+            'version': __version__,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'date': time.strftime('%Y-%m-%dT%H:%M:%S')
+        }
+
+        with open(json_file, 'w') as fp:
+            json.dump({'environment': environment, 'results': results}, fp, indent=1)
+
+    if csv_file is not None:
+        with open(csv_file, 'w') as results_file:
+            writer = csv.writer(results_file)
+            writer.writerow(COLUMNS)
+            writer.writerows([record[column] for column in COLUMNS] for record in results)
+
+
+if __name__ == '__main__':
+    main()
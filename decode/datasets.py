@@ -1,16 +1,54 @@
-import pickle
+import os
 import numpy as np
-from importlib.resources import open_binary
+from collections import Counter
 
+# Amino acid order of the columns of O, D and D_hat
+AA_IDX = 'ACDEFGHIKLMNPQRSTVWY*-'
 
-with open_binary('decode.data', 'codons.pickle') as codon_file:
-    all_codons = pickle.load(codon_file)
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
 
-with open_binary('decode.data', 'codon_aa_mapping.pickle') as codon_aa_mapping_file:
-    codon_aa_mapping = pickle.load(codon_aa_mapping_file)
 
-with open_binary('decode.data', 'D.npy') as D_file:
-    D = np.load(D_file)
-    
-with open_binary('decode.data', 'D_hat.npy') as D_hat_file:
-    D_hat = np.load(D_hat_file)
+def load_array(name):
+    # Memory map a codon table read-only, so that its pages are only read
+    # on use and are shared between the processes of a pool
+    return np.load(os.path.join(DATA_DIR, name + '.npy'), mmap_mode='r')
+
+
+def _all_codons():
+    # Least degenerate codon keys of every codon class (row of D), in the
+    # order of the codon mapping
+    keys = load_array('codon_keys').astype(str)
+    classes = np.asarray(load_array('codon_classes'))
+
+    members = np.flatnonzero(classes >= 0)
+    members = members[np.argsort(classes[members], kind='stable')]
+    bounds = np.cumsum(np.bincount(classes[members]))[:-1]
+
+    return [group.tolist() for group in np.split(keys[members], bounds)]
+
+
+def _codon_aa_mapping():
+    # Amino acid counts of every degenerate codon, in the order the amino
+    # acids appear in the expanded codon
+    keys = load_array('codon_keys').astype(str).tolist()
+    counts = load_array('codon_aa_counts').tolist()
+    order = load_array('codon_aa_order').tolist()
+
+    return {key: Counter({AA_IDX[j]: row[j] for j in aas if j >= 0}) for key, row, aas in zip(keys, counts, order)}
+
+
+_LOADERS = {
+    'D': lambda: load_array('D'),
+    'D_hat': lambda: load_array('D_hat'),
+    'all_codons': _all_codons,
+    'codon_aa_mapping': _codon_aa_mapping
+}
+
+
+def __getattr__(name):
+    # Load the codon data on first use and keep it as a module attribute
+    if name not in _LOADERS:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__, name))
+
+    value = globals()[name] = _LOADERS[name]()
+    return value
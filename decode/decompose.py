@@ -0,0 +1,137 @@
+import os
+import time
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from .datasets import D, D_hat
+from .ilp import solve_library
+from .presolve import target_matrix
+
+def cluster_targets(O, n_clusters, method='ward'):
+    """Cluster the targets by the Hamming distance between their variable
+    positions, with the given scipy linkage method.
+
+    Returns the cluster index (0 to at most n_clusters - 1) of every target.
+    """
+    from scipy.cluster.hierarchy import fcluster, linkage
+    from scipy.spatial.distance import pdist
+
+    residues = target_matrix(O)
+
+    if len(residues) == 1 or n_clusters == 1:
+        return np.zeros(len(residues), dtype=int)
+
+    # Euclidean distance between the one-hot encoded targets (the square
+    # root of twice the Hamming distance), so that Ward linkage applies
+    distances = np.sqrt(2 * residues.shape[1] * pdist(residues, 'hamming'))
+    tree = linkage(distances, method=method)
+    labels = fcluster(tree, n_clusters, criterion='maxclust')
+
+    # Number the clusters from 0
+    return np.unique(labels, return_inverse=True)[1].reshape(-1)
+
+
+def split_budget(lib_lim, sizes):
+    # Share of the library size limit of every cluster: one sequence each,
+    # and the rest in proportion to its number of targets, so that the
+    # shares add up to at most lib_lim
+    sizes = np.asarray(sizes, dtype=float)
+
+    if lib_lim < len(sizes):
+        raise ValueError('A size limit of {} cannot be split between {} clusters.'.format(lib_lim, len(sizes)))
+
+    return 1 + np.floor((lib_lim - len(sizes)) * sizes / sizes.sum()).astype(int)
+
+
+def _solve_cluster(O, lib_lim, kwargs):
+    # Single-template subproblem of one cluster, run in a worker process
+    return solve_library(O, lib_lim, 1, verbose=False, **kwargs)
+
+
+def solve_decomposed(O, lib_lim, n_templates, verbose=True, n_workers=None, cores=None, repair=False,
+                     repair_time_limit=60, cluster_method='ward', **kwargs):
+    """Design a multi-sublibrary library by target clustering.
+
+    The targets are clustered into (at most) n_templates groups by Hamming
+    distance, the size limit is split between the clusters in proportion
+    to their number of targets, and the single-template subproblem of every
+    cluster is solved in a separate process, dividing the cores between
+    the processes as solver threads. With repair, the combined library is
+    used to start the full multi-template ILP, solved with a time limit of
+    repair_time_limit seconds. Other keyword arguments are passed on to
+    solve_library.
+
+    Returns a solution dictionary with the same entries as solve_library.
+    """
+    start = time.time()
+    O = target_matrix(O)
+    n_var_pos = O.shape[1]
+
+    # Every template holds at least one sequence
+    n_templates = min(n_templates, lib_lim)
+
+    labels = cluster_targets(O, n_templates, cluster_method)
+    n_clusters = labels.max() + 1
+    members = [np.flatnonzero(labels == c) for c in range(n_clusters)]
+    budgets = split_budget(lib_lim, [len(m) for m in members])
+
+    if verbose:
+        print('Split {} targets into {} clusters of {} targets.\n'.format(
+            len(O), n_clusters, ', '.join(str(len(m)) for m in members)))
+
+    cores = cores or os.cpu_count() or 1
+    n_workers = min(n_workers or cores, n_clusters)
+    kwargs = dict(kwargs, threads=max(1, cores // n_workers))
+
+    subproblems = [(O[m], budget) for m, budget in zip(members, budgets)]
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            solutions = list(pool.map(_solve_cluster, *zip(*subproblems), [kwargs] * n_clusters))
+    else:
+        solutions = [_solve_cluster(O_sub, budget, kwargs) for O_sub, budget in subproblems]
+
+    # Combine the cluster templates into one library, in which a target
+    # can be covered by the template of any cluster
+    codon_selection = np.concatenate([solution['codon_selection'] for solution in solutions])
+    codons = np.argmax(codon_selection, axis=2)
+
+    covered = np.stack([np.all(D_hat[codons[s], O] > 0, axis=1) for s in range(n_clusters)], axis=1)
+
+    if verbose:
+        sizes = np.prod(np.sum(D[codons], axis=2), axis=1)
+        print('Decomposed library covers {} targets with {:g} sequences.\n'.format(
+            int(covered.any(axis=1).sum()), sizes.sum()))
+
+    solve_time = time.time() - start
+
+    solution = {
+        'binary_coverage': covered.any(axis=1).astype(float),
+        'coverage_count': covered.sum(axis=1).astype(float),
+        'codon_selection': codon_selection,
+        'candidate_counts': [max(s['candidate_counts'][p] for s in solutions) for p in range(n_var_pos)],
+        'n_distinct_targets': sum(s['n_distinct_targets'] for s in solutions),
+        'status': 'decomposed',
+        'objective': float(covered.any(axis=1).sum()),
+        'bound': None,
+        'build_time': sum(s['build_time'] for s in solutions),
+        'solve_time': solve_time
+    }
+
+    if repair:
+        if verbose:
+            print('Repairing the decomposed library with the full ILP.\n')
+
+        # The clustering can give fewer clusters than templates (e.g. for
+        # few distinct targets), so the full ILP may use the remaining
+        # templates, which start with a single sequence each
+        single = np.argmin(np.sum(D, axis=1))
+        start_codons = np.concatenate([codons, np.full((n_templates - n_clusters, n_var_pos), single)])
+
+        kwargs.update(threads=cores, time_limit=repair_time_limit)
+        repaired = solve_library(O, lib_lim, n_templates, verbose=verbose, start_codons=start_codons, **kwargs)
+
+        if repaired['objective'] >= solution['objective']:
+            repaired['solve_time'] += solve_time
+            solution = repaired
+
+    return solution
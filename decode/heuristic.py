@@ -0,0 +1,277 @@
+import time
+import numpy as np
+from .datasets import D, D_hat
+from .presolve import prepare_targets, prune_codons
+
+def greedy_library(residues, weights, cover, cost, lib_lim, n_templates, bin_upper_lim=None, lookahead=64):
+    """Greedily build a library by adding targets to templates.
+
+    residues is the (n_targets x n_var_pos) residue index matrix and
+    cover[p] / cost[p] hold, for the candidate codons at position p, their
+    (n_candidates x n_aas) residue coverage and log degeneracy. Each
+    template uses the least degenerate codons that cover all of its
+    targets. At every step, the `lookahead` (template, target) additions
+    that grow the total library size the least are scored by the target
+    weight they newly cover per unit of added library size, and the best
+    one is made. If bin_upper_lim is given, the size of every template is
+    rounded up to its bin as in bin_oligo_count.
+
+    Returns the (n_templates x n_var_pos) chosen candidate index at every
+    position and the (n_targets x n_templates) boolean coverage.
+    """
+    return beam_search(residues, weights, cover, cost, lib_lim, n_templates, bin_upper_lim,
+                       width=1, lookahead=lookahead)
+
+
+def beam_search(residues, weights, cover, cost, lib_lim, n_templates, bin_upper_lim=None,
+                width=8, lookahead=64):
+    """Beam search version of greedy_library.
+
+    Every library in the beam is extended by its `width` best scoring
+    additions, and the `width` extended libraries covering the most target
+    weight (then the smallest ones) are kept. The search stops when no
+    library can be extended within lib_lim, and returns the best library
+    found in the same form as greedy_library.
+    """
+    search = {
+        'residues': residues,
+        'weights': weights,
+        'cover': cover,
+        'cost': cost,
+        'lib_lim': lib_lim,
+        'bin_upper_lim': bin_upper_lim
+    }
+
+    best = _search(search, n_templates, width, lookahead)
+
+    # A wider beam can prune the greedy path, so never return a library
+    # worse than the greedy one
+    if width > 1:
+        greedy = _search(search, n_templates, 1, lookahead)
+
+        if (greedy['covered_weight'], -greedy['total']) > (best['covered_weight'], -best['total']):
+            best = greedy
+
+    return best['chosen'], best['covered']
+
+
+def solve_heuristic(O, lib_lim, n_templates, width=8, lookahead=64, verbose=True):
+    """Design a library with beam_search, without building the ILP.
+
+    Uses the same pruned candidate codons as solve_library and the exact
+    library size of every template, and returns a solution dictionary with
+    the same entries as solve_library.
+    """
+    n_codons = D.shape[0]
+    n_var_pos = len(O[0])
+
+    build_start = time.time()
+
+    residues, target_idx, weights, observed = prepare_targets(O)
+    candidates = prune_codons(observed)
+    candidate_counts = [len(c) for c in candidates]
+
+    if verbose:
+        print('Number of distinct targets:\t{}'.format(len(residues)))
+        print('Candidate codons per position:\t{} to {} (of {})\n'.format(min(candidate_counts),
+                                                                         max(candidate_counts), n_codons))
+        print('Running beam search with width {}.\n'.format(width))
+
+    cover = [D_hat[c] > 0 for c in candidates]
+    cost = [np.log(np.sum(D[c], axis=1)) for c in candidates]
+
+    build_time = time.time() - build_start
+    solve_start = time.time()
+
+    chosen, covered = beam_search(residues, weights, cover, cost, lib_lim, n_templates,
+                                  width=width, lookahead=lookahead)
+
+    solve_time = time.time() - solve_start
+
+    # Expand the chosen candidates into (template x position x codon) selections
+    codon_selection = np.zeros((n_templates, n_var_pos, n_codons))
+
+    for s in range(n_templates):
+        codon_selection[s, np.arange(n_var_pos), [candidates[p][chosen[s, p]] for p in range(n_var_pos)]] = 1
+
+    solution = {
+        'binary_coverage': covered.any(axis=1)[target_idx].astype(float),
+        'coverage_count': covered.sum(axis=1)[target_idx].astype(float),
+        'codon_selection': codon_selection,
+        'candidate_counts': candidate_counts,
+        'n_distinct_targets': len(residues),
+        'status': 'heuristic',
+        'objective': float(weights @ covered.any(axis=1)),
+        'bound': None,
+        'build_time': build_time,
+        'solve_time': solve_time
+    }
+
+    return solution
+
+
+def _search(search, n_templates, width, lookahead):
+    beam = [_initial_state(search, n_templates)]
+    best = beam[0]
+
+    while beam:
+        children = []
+
+        for state in beam:
+            for s, j in _best_additions(search, state, width, lookahead):
+                children.append(_add_target(search, state, s, j))
+
+        # Keep the best distinct libraries
+        children.sort(key=lambda state: (-state['covered_weight'], state['total']))
+        beam, seen = [], set()
+
+        for state in children:
+            key = state['chosen'].tobytes()
+            if key not in seen and len(beam) < width:
+                seen.add(key)
+                beam.append(state)
+
+        if beam and (beam[0]['covered_weight'], -beam[0]['total']) > (best['covered_weight'], -best['total']):
+            best = beam[0]
+
+    return best
+
+
+def _template_size(search, log_n_seq):
+    # Size of templates with the given log sizes, rounded up to their
+    # bins if the sizes are binned
+    bin_upper_lim = search['bin_upper_lim']
+
+    if bin_upper_lim is None:
+        return np.exp(log_n_seq)
+
+    b = np.minimum(np.searchsorted(bin_upper_lim, log_n_seq - 1e-9), len(bin_upper_lim) - 1)
+
+    return np.where(log_n_seq <= bin_upper_lim[-1] + 1e-9, np.exp(bin_upper_lim[b]), np.inf)
+
+
+def _cheapest(search, p, mask):
+    # Cheapest candidate covering the residues in mask plus each single
+    # residue, as an (n_aas) array of costs and candidate indices
+    cover, cost = search['cover'][p], search['cost'][p]
+    feasible = cover[:, mask].all(axis=1)[:, None] & cover
+    costs = np.where(feasible, cost[:, None], np.inf)
+
+    return costs.min(axis=0), costs.argmin(axis=0)
+
+
+def _n_covered_positions(search, chosen):
+    # Number of positions of every target covered by a template
+    residues, cover = search['residues'], search['cover']
+    return np.sum([cover[p][chosen[p], residues[:, p]] for p in range(residues.shape[1])], axis=0)
+
+
+def _update_totals(search, state):
+    state['covered'] = (state['n_covered'] == search['residues'].shape[1]).T
+    state['covered_weight'] = search['weights'] @ state['covered'].any(axis=1)
+    state['sizes'] = _template_size(search, state['current'].sum(axis=1))
+    state['total'] = state['sizes'].sum()
+
+
+def _initial_state(search, n_templates):
+    residues, cost = search['residues'], search['cost']
+    n_var_pos = residues.shape[1]
+    n_aas = search['cover'][0].shape[1]
+    positions = np.arange(n_var_pos)
+
+    # Required residues, chosen candidates and per-position costs of
+    # every template, starting from the cheapest codon at every position
+    state = {
+        'masks': np.zeros((n_templates, n_var_pos, n_aas), dtype=bool),
+        'chosen': np.array([[np.argmin(cost[p]) for p in positions]] * n_templates),
+        'current': np.array([[cost[p].min() for p in positions]] * n_templates),
+        'best': np.zeros((n_templates, n_var_pos, n_aas)),
+        'best_idx': np.zeros((n_templates, n_var_pos, n_aas), dtype=int)
+    }
+
+    # Cost of every position after adding each residue, and the resulting
+    # total cost increase of adding each target to each template
+    for s in range(n_templates):
+        for p in positions:
+            state['best'][s, p], state['best_idx'][s, p] = _cheapest(search, p, state['masks'][s, p])
+
+    state['increase'] = np.stack([(state['best'][s][positions, residues] - state['current'][s]).sum(axis=1)
+                                  for s in range(n_templates)])
+
+    # Number of positions of every target covered by every template
+    state['n_covered'] = np.stack([_n_covered_positions(search, state['chosen'][s])
+                                   for s in range(n_templates)])
+
+    _update_totals(search, state)
+
+    return state
+
+
+def _best_additions(search, state, n_additions, lookahead):
+    # The n_additions best scoring (template, target) additions that keep
+    # the library within lib_lim
+    residues, weights, cover = search['residues'], search['weights'], search['cover']
+    n_var_pos = residues.shape[1]
+    positions = np.arange(n_var_pos)
+    max_log = np.log(search['lib_lim']) + 1e-9
+
+    uncovered = ~state['covered'].any(axis=1)
+    candidates = np.flatnonzero(uncovered)
+
+    if len(candidates) == 0:
+        return []
+
+    # Total library size after adding each uncovered target to each template
+    log_n_seq = state['current'].sum(axis=1)
+    new_log = log_n_seq[:, None] + state['increase'][:, candidates]
+    new_total = state['total'] - state['sizes'][:, None] + \
+        np.where(new_log <= max_log, _template_size(search, new_log), np.inf)
+
+    order = np.argsort(new_total, axis=None, kind='stable')[:lookahead]
+    order = order[new_total.flat[order] <= search['lib_lim'] * (1 + 1e-9)]
+
+    # Score the cheapest additions by the uncovered target weight
+    # they cover per unit of library size they add
+    scores = []
+
+    for k in order:
+        s, j = np.unravel_index(k, new_total.shape)
+        j = candidates[j]
+        count = state['n_covered'][s].copy()
+
+        for p in np.flatnonzero(~state['masks'][s, positions, residues[j]]):
+            count += cover[p][state['best_idx'][s, p, residues[j, p]], residues[:, p]]
+            count -= cover[p][state['chosen'][s, p], residues[:, p]]
+
+        gain = weights[uncovered & (count == n_var_pos)].sum()
+        scores.append(gain / (new_total.flat[k] - state['total'] + 1e-9))
+
+    additions = []
+
+    for k in order[np.argsort(scores, kind='stable')[::-1][:n_additions]]:
+        s, j = np.unravel_index(k, new_total.shape)
+        additions.append((s, candidates[j]))
+
+    return additions
+
+
+def _add_target(search, state, s, j):
+    # Copy of the state with the residues of target j added to template s
+    residues = search['residues']
+    positions = np.arange(residues.shape[1])
+    state = {key: value.copy() if isinstance(value, np.ndarray) else value for key, value in state.items()}
+
+    masks, best, best_idx = state['masks'], state['best'], state['best_idx']
+
+    for p in np.flatnonzero(~masks[s, positions, residues[j]]):
+        a = residues[j, p]
+        masks[s, p, a] = True
+        state['chosen'][s, p] = best_idx[s, p, a]
+        state['current'][s, p] = best[s, p, a]
+        best[s, p], best_idx[s, p] = _cheapest(search, p, masks[s, p])
+
+    state['increase'][s] = (best[s][positions, residues] - state['current'][s]).sum(axis=1)
+    state['n_covered'][s] = _n_covered_positions(search, state['chosen'][s])
+    _update_totals(search, state)
+
+    return state
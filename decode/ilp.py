@@ -1,93 +1,474 @@
-import cvxpy
+import copy
+import json
+import time
 import numpy as np
+from scipy import sparse
+from . import datasets
+from .backends import Model, is_feasible, read_model, solve, write_model
 from .datasets import D, D_hat
+from .heuristic import greedy_library
+from .presolve import prepare_targets, prune_codons
+from .profiling import phase
 
-def solve_library(O, lib_lim, n_templates, bins=1e3, verbose=True, parallel=True,
-                  approximate=False, time_limit=0, threads=0):
+@phase('build_model')
+def build_library(O, n_templates, verbose=True, prune=True, symmetry='none'):
+    """Build the part of the library design ILP that does not depend on
+    the library size limit.
+
+    The templates are interchangeable, so with symmetry='size' they are
+    ordered by decreasing library size, and with symmetry='target' by the
+    lowest index of the targets assigned to them, which leaves one of the
+    n_templates! equivalent copies of every library.
+
+    The returned dictionary can be passed to solve_library to solve the
+    same targets and template count under several size limits without
+    rebuilding the model.
+    """
     ####################
     # i = n_targets    #
     # s = n_templates  #
     # p = n_var_pos    #
     # a = n_aas        #
+    # k = n_columns    #
     ####################
     
-    # Extract number of codons and number of amino acid options
-    n_codons, n_aas = D.shape
-    n_targets = len(O)
+    # Extract number of codons
+    n_codons = D.shape[0]
     n_var_pos = len(O[0])
     
+    # Start timing the model construction
+    build_start = time.time()
+    
+    # Collapse identical targets into a single weighted target
+    residues, target_idx, weights, observed = prepare_targets(O)
+    n_targets = len(residues)
+    
+    if verbose:
+        print('Number of distinct targets: {} of {}.\n'.format(n_targets, len(O)))
+    
+    # Pre-solve: restrict each position to its candidate codons
+    if prune:
+        candidates = prune_codons(observed)
+    else:
+        candidates = [np.arange(n_codons) for p in range(n_var_pos)]
+        
+    candidate_counts = [len(c) for c in candidates]
+    
+    if verbose:
+        print('Codon candidates per position: {} -> {}-{} ({} -> {} columns per template).\n'.format(
+            n_codons, min(candidate_counts), max(candidate_counts),
+            n_codons * n_var_pos, sum(candidate_counts)))
+    
+    # Every column k of a template is a (position, codon) pair
+    col_pos = np.repeat(np.arange(n_var_pos), candidate_counts)
+    col_codon = np.concatenate(candidates)
+    n_columns = len(col_codon)
+    
+    # Assignment of columns to positions (n_var_pos x n_columns)
+    A = sparse.csr_matrix((np.ones(n_columns), (col_pos, np.arange(n_columns))), shape=(n_var_pos, n_columns))
+    
+    # Coverage of the targets by each column (n_targets x n_columns)
+    K = sparse.hstack([sparse.csr_matrix(D_hat[c][:, residues[:, p]].T) for p, c in enumerate(candidates)]).tocsr()
+    
     # Set up variables
-    t = cvxpy.Variable(n_targets, boolean=True)
-    G = {s: cvxpy.Variable((n_var_pos, n_codons), boolean=True) for s in range(n_templates)}
-    C = []
-    B = cvxpy.Variable((n_targets, n_templates), boolean=True)
-
-    # Set up constraints
-    constraints = []
-
-    # Define relationship between C, G, and D
-    for s in range(n_templates):
-        C.append(G[s] * D_hat)
+    model = Model()
+    t = model.add_variables(n_targets)
+    G = model.add_variables((n_templates, n_columns))
+    B = model.add_variables((n_targets, n_templates))
 
     # Constrain only one deg. codon can be used
     for s in range(n_templates):
-        constraints.append(cvxpy.sum(G[s], axis=1) == 1)
+        model.add_constraints([(A, G[s])], lb=1, ub=1)
 
-    # Constrain "and" for all positions (check for cover of target)
-    for i in range(n_targets):
-        for s in range(n_templates):
-            expression = cvxpy.sum(cvxpy.multiply(O[i], C[s])) - n_var_pos + n_var_pos * (1 - B[i, s])
-            constraints.append(expression >= 0)
-            constraints.append(expression <= n_var_pos)
+    # Constrain "and" for all positions (check for cover of target), one
+    # matrix constraint per template covering all targets at once
+    for s in range(n_templates):
+        model.add_constraints([(K, G[s]), (-n_var_pos * sparse.identity(n_targets), B[:, s])],
+                              lb=0, ub=n_var_pos)
 
     # Constrain "or" for all oligos (check whether target is covered by at least one oligo)
-    expression =  - cvxpy.sum(B, axis=1) + (n_templates + 1) * t
-    constraints.append(expression >= 0)
-    constraints.append(expression <= n_templates)
+    model.add_constraints([(-sparse.kron(sparse.identity(n_targets), np.ones((1, n_templates))), B),
+                           ((n_templates + 1) * sparse.identity(n_targets), t)],
+                          lb=0, ub=n_templates)
+    
+    log_deg = np.log(np.sum(D[col_codon], axis=1))
+    
+    # Break the symmetry between templates
+    U = None
+    
+    if symmetry == 'size':
+        # log_n_seq[s] >= log_n_seq[s + 1]
+        for s in range(n_templates - 1):
+            model.add_constraints([(log_deg[None, :], G[s]), (-log_deg[None, :], G[s + 1])], lb=0)
+            
+    elif symmetry == 'target':
+        # Template s can only be assigned target i if template s - 1 is
+        # assigned a target before i, where U[i, s] is 1 if and only if
+        # template s is assigned one of the targets up to i
+        U = model.add_variables((n_targets, n_templates - 1))
+        identity = sparse.identity(n_targets)
+        previous = sparse.eye(n_targets, k=-1)
+        
+        for s in range(n_templates - 1):
+            # U[i, s] >= U[i - 1, s]
+            model.add_constraints([(identity - previous, U[:, s])], lb=0)
+            # U[i, s] >= B[i, s]
+            model.add_constraints([(identity, U[:, s]), (-identity, B[:, s])], lb=0)
+            # U[i, s] <= U[i - 1, s] + B[i, s]
+            model.add_constraints([(identity - previous, U[:, s]), (-identity, B[:, s])], ub=0)
+            # B[i, s + 1] <= U[i - 1, s]
+            model.add_constraints([(identity, B[:, s + 1]), (-previous, U[:, s])], ub=0)
+            
+    elif symmetry != 'none':
+        raise ValueError('Unknown symmetry breaking {}, expected none, size or target.'.format(symmetry))
+
+    # Maximize covered sequences subject to constraints
+    model.set_objective(weights, t)
+    
+    library = {
+        'model': model,
+        't': t,
+        'G': G,
+        'B': B,
+        'U': U,
+        'K': K,
+        'residues': residues,
+        'observed': observed,
+        'target_idx': target_idx,
+        'weights': weights,
+        'candidates': candidates,
+        'candidate_counts': candidate_counts,
+        'col_pos': col_pos,
+        'col_codon': col_codon,
+        'log_deg': log_deg,
+        'symmetry': symmetry,
+        'build_time': time.time() - build_start
+    }
+    
+    return library
 
-    # Constrain library size for a single oligo
-    if n_templates == 1 and not approximate:
-        print('Using exact library size.\n')
-        # Constrain library size
-        lib_size = cvxpy.sum(G[0] * cvxpy.log(cvxpy.sum(D, axis=1)))
-        constraints.append(lib_size <= cvxpy.log(lib_lim))
+
+def solve_library(O, lib_lim, n_templates, bins=1e3, verbose=True, approximate=False,
+                  time_limit=0, threads=0, prune=True, solver='gurobi', warm_start='greedy',
+                  library=None, start_codons=None, symmetry='none', size_model='bins', bin_grid=None,
+                  progress=None, export=None, export_info=None, export_only=False):
+    """Design a library of at most lib_lim sequences from n_templates
+    templates covering the most targets in O.
+
+    library is an optional result of build_library for the same O and
+    n_templates. start_codons is an optional (n_templates x n_var_pos)
+    array of codon indices of a previous library (e.g. the solution of a
+    smaller size limit) to start the solver from; it is used instead of
+    the greedy warm start if it is feasible and covers more targets.
+    symmetry is passed on to build_library.
+    
+    size_model selects the approximate library size constraint of
+    multi-template libraries: 'bins' (one binary per template and bin),
+    'log' (the same bins, with the bin index of every template encoded
+    in log2(bins) binaries) or 'pwl' (a piecewise linear size without
+    binaries, which is never larger than the binned size). bin_grid
+    optionally replaces the uniform bins with the given increasing log
+    library sizes, which requires size_model='bins'.
+    
+    The solver progress (see backends.solve) is returned as a time series
+    in 'progress', and is also passed to progress, if given, as it comes
+    in (e.g. to stream it to a file).
+    
+    If export is given, the model and its warm start are written to it
+    before solving (see write_library_model), with the entries of
+    export_info in the column map, so that solve_model can solve it again
+    without building it. With export_only, the model is only written and
+    None is returned.
+    """
+    n_var_pos = len(O[0])
+    
+    if library is None:
+        library = build_library(O, n_templates, verbose=verbose, prune=prune, symmetry=symmetry)
+    
+    build_start = time.time()
+    
+    with phase('build_model'):
+        # Add the library size constraints to a copy of the shared model
+        model = copy.deepcopy(library['model'])
+        t, G, B, K = library['t'], library['G'], library['B'], library['K']
+        weights, candidates = library['weights'], library['candidates']
+        candidate_counts = library['candidate_counts']
+        log_deg = library['log_deg']
         
-    else:
-        print('Using approximate library size.\n')
-        if bins > lib_lim:
-            bins = lib_lim
-        bin_constraints, lib_size = bin_oligo_count(lib_lim, n_templates, G, D, bins)
-        constraints.extend(bin_constraints)
+        if n_templates == 1 and not approximate:
+            if verbose:
+                print('Using exact library size.\n')
+                
+            # Constrain library size
+            model.add_constraints([(log_deg[None, :], G[0])], ub=np.log(lib_lim))
+            bin_vars, bin_upper_lim = None, None
+            size_model = None
+            
+        else:
+            if verbose:
+                print('Using approximate library size.\n')
+                
+            if bins > lib_lim:
+                bins = lib_lim
+                
+            if bin_grid is not None and size_model != 'bins':
+                raise ValueError('Custom bins require the bins size model.')
+            
+            bin_upper_lim = bin_limits(lib_lim, bins)[1] if bin_grid is None else np.asarray(bin_grid)
+            
+            if size_model == 'bins':
+                bin_vars = bin_oligo_count(model, lib_lim, G, log_deg, bins, bin_upper_lim)
+            else:
+                bin_vars = None
+                size_vars = log_oligo_count(model, lib_lim, G, log_deg, bins, encoding=size_model)
 
-    # Define the objective            
-    objective = cvxpy.sum(t)
+    with phase('canonicalize'):
+        arrays = model.arrays()
     
-    # Maximize covered sequences subject to constraints
-    problem = cvxpy.Problem(cvxpy.Maximize(objective), constraints)
+    def library_start(columns):
+        # Solution vector of the library using the given
+        # (n_templates x n_var_pos) columns
+        x = np.zeros(model.n_vars)
+        covered = np.stack([np.asarray(K[:, columns[s]].sum(axis=1)).reshape(-1) == n_var_pos
+                            for s in range(n_templates)], axis=1)
+        
+        # Reorder the templates to satisfy the symmetry breaking constraints
+        if library['symmetry'] == 'size':
+            order = np.argsort(-np.sum(log_deg[columns], axis=1), kind='stable')
+            columns, covered = columns[order], covered[:, order]
+            
+        elif library['symmetry'] == 'target':
+            # Assign every target only to the first template covering it
+            covered = covered & (np.cumsum(covered, axis=1) == 1)
+            first = np.where(covered.any(axis=0), np.argmax(covered, axis=0), len(covered))
+            order = np.argsort(first, kind='stable')
+            columns, covered = columns[order], covered[:, order]
+            x[library['U']] = np.maximum.accumulate(covered, axis=0)[:, :-1]
+        
+        x[t] = covered.any(axis=1)
+        x[B] = covered
+        
+        for s in range(n_templates):
+            x[G[s][columns[s]]] = 1
+            
+            log_n_seq = np.sum(log_deg[columns[s]])
+            
+            if bin_vars is not None:
+                x[bin_vars[s, min(np.searchsorted(bin_upper_lim, log_n_seq - 1e-9), len(bin_upper_lim) - 1)]] = 1
+                
+            elif size_model in ('log', 'pwl'):
+                x[size_vars[0][s]] = log_n_seq
+                
+                if size_model == 'log':
+                    k = min(np.searchsorted(bin_upper_lim, log_n_seq - 1e-9), len(bin_upper_lim) - 1)
+                    x[size_vars[2][s]] = (k >> np.arange(size_vars[2].shape[1])) & 1
+                else:
+                    k = np.interp(log_n_seq, bin_upper_lim, np.arange(len(bin_upper_lim)))
+                    
+                x[size_vars[1][s]] = k
+                
+        return x
+    
+    offsets = np.cumsum([0] + candidate_counts[:-1])
+    starts = []
+    
+    with phase('warm_start'):
+        # Build a greedy library to start the solver from
+        if warm_start == 'greedy':
+            chosen, covered = greedy_library(library['residues'], weights, [D_hat[c] > 0 for c in candidates],
+                                             [np.log(np.sum(D[c], axis=1)) for c in candidates],
+                                             lib_lim, n_templates, bin_upper_lim)
+            starts.append(library_start(offsets + chosen))
+            
+            if verbose:
+                print('Greedy warm start covers {:g} targets.\n'.format(weights @ starts[-1][t]))
+        
+        # Start from a previous library if it is feasible under this limit,
+        # replacing every codon by the least degenerate candidate covering
+        # at least the same observed residues
+        if start_codons is not None:
+            start_codons = np.asarray(start_codons)
+            columns = np.zeros((n_templates, n_var_pos), dtype=int)
+            
+            for p in range(n_var_pos):
+                cover = D_hat[candidates[p]][:, library['observed'][p]] > 0
+                
+                for s in range(n_templates):
+                    superset = offsets[p] + np.flatnonzero(
+                        np.all(cover >= (D_hat[start_codons[s, p], library['observed'][p]] > 0), axis=1))
+                    columns[s, p] = superset[np.argmin(log_deg[superset])]
+                    
+            previous = library_start(columns)
+            
+            if is_feasible(arrays, previous):
+                starts.append(previous)
+                
+                if verbose:
+                    print('Previous library covers {:g} targets.\n'.format(weights @ previous[t]))
+        
+        # Otherwise start from the smallest library, with the least
+        # degenerate codon at every position, so that the solver always
+        # has a solution at the time limit
+        if not starts:
+            cheapest = [offsets[p] + np.argmin(log_deg[offsets[p]:offsets[p] + candidate_counts[p]])
+                        for p in range(n_var_pos)]
+            starts.append(library_start(np.tile(cheapest, (n_templates, 1))))
+        
+    start = max(starts, key=lambda x: weights @ x[t])
     
-    aux_params = {}
+    # End timing the model construction
+    build_time = library['build_time'] + time.time() - build_start
     
-    if time_limit > 0:
-        aux_params['TimeLimit'] = time_limit
+    # Write the model to solve it again with other solver settings or on
+    # another machine
+    if export is not None:
+        write_library_model(export, arrays, library, n_var_pos, start=start, info=export_info)
         
-    if threads > 0:
-        aux_params['Threads'] = threads
+        if export_only:
+            return None
 
+    # Record the solver progress
+    points, record = progress_recorder(progress)
+    
     # Solving the problem
-    problem.solve(solver=cvxpy.GUROBI, verbose=verbose, parallel=parallel, **aux_params)
+    result = solve(arrays, solver=solver, verbose=verbose, time_limit=time_limit, threads=threads, start=start,
+                   progress=record)
+    
+    return library_solution(result, arrays, library, n_var_pos, build_time, points)
+
+
+def progress_recorder(progress=None):
+    # List of the solver progress points and the callback that appends
+    # every point to it, and passes it on to progress, if given
+    points = []
+    
+    def record(point):
+        points.append(point)
+        
+        if progress is not None:
+            progress(point)
+    
+    return points, record
+
+
+def library_solution(result, arrays, library, n_var_pos, build_time, points):
+    # Map the solver result onto the targets and the codons of the library
+    x = result['x']
+    t, G, B = library['t'], library['G'], library['B']
+    
+    # Map the selected columns back onto (position, codon) pairs
+    codon_selection = np.zeros((len(G), n_var_pos, D.shape[0]))
+    
+    for s in range(len(G)):
+        codon_selection[s, library['col_pos'], library['col_codon']] = x[G[s]]
     
     # Make all variables available within a dictionary
     solution = {
-        'binary_coverage': t.value,
-        'coverage_count': np.sum(B.value, axis=1),
-        'codon_selection': np.stack([G[x].value for x in G]),
-        'problem': problem
+        'binary_coverage': x[t][library['target_idx']],
+        'coverage_count': np.sum(x[B], axis=1)[library['target_idx']],
+        'codon_selection': codon_selection,
+        'candidate_counts': library['candidate_counts'],
+        'n_distinct_targets': len(library['weights']),
+        'status': result['status'],
+        'objective': result['objective'],
+        'bound': result['bound'],
+        'build_time': build_time,
+        'solve_time': result['solve_time'],
+        'model_size': {'rows': arrays['A'].shape[0], 'columns': arrays['A'].shape[1], 'nonzeros': arrays['A'].nnz},
+        'progress': points
     }
     
     return solution
 
 
-def bin_oligo_count(lib_lim, n_templates, G, D, n_bins=1e3):
+# Entries of a library that are written to the column map of its model
+COLUMN_MAP_KEYS = ['t', 'B', 'G', 'col_pos', 'col_codon', 'target_idx', 'weights', 'candidate_counts']
+
+
+def write_library_model(filename, arrays, library, n_var_pos, start=None, info=None):
+    """Write the ILP of a library design to an MPS or LP file (see
+    backends.write_model), and its column map to filename + '.json'.
+    
+    The column map holds the columns of the t, B and G variables, the
+    (position, codon index, codon) of every column of a template in G,
+    the targets of every distinct target and their weights, the nonzero
+    entries of the start, if given, and the entries of info (e.g. the
+    alignment, to write the output of solve_model).
+    """
+    write_model(arrays, filename)
+    
+    column_map = {key: np.asarray(library[key]).tolist() for key in COLUMN_MAP_KEYS}
+    column_map['col_codon_key'] = [datasets.all_codons[c][0] for c in column_map['col_codon']]
+    column_map['n_columns'] = arrays['A'].shape[1]
+    column_map['n_var_pos'] = n_var_pos
+    column_map['start'] = None
+    
+    if start is not None:
+        nonzero = np.flatnonzero(start)
+        column_map['start'] = {'columns': nonzero.tolist(), 'values': start[nonzero].tolist()}
+    
+    column_map.update(info or {})
+    
+    with open(filename + '.json', 'w') as fp:
+        json.dump(column_map, fp)
+
+
+def solve_model(filename, solver='gurobi', verbose=True, time_limit=0, threads=0, warm_start=True,
+                progress=None):
+    """Solve a model written by write_library_model (e.g. through the
+    export argument of solve_library) without building it, starting from
+    its stored start if warm_start, and map the solution back onto the
+    library.
+    
+    The columns are matched to the column map by their names, so the
+    file can also have been rewritten by another program. Columns it
+    added (e.g. the slacks of ranged rows) are kept after the others.
+    
+    Returns the solution, as returned by solve_library, and the column
+    map.
+    """
+    read_start = time.time()
+    
+    with open(filename + '.json', 'r') as fp:
+        column_map = json.load(fp)
+    
+    with phase('read_model'):
+        arrays, names = read_model(filename)
+    
+    n_columns = column_map['n_columns']
+    index = {'x{}'.format(j): j for j in range(n_columns)}
+    found = [index.get(name, -1) for name in names]
+    
+    if len(set(found) - {-1}) != n_columns:
+        raise ValueError('The columns of {} do not match its column map.'.format(filename))
+    
+    # Move the columns into the order of the column map
+    order = np.argsort([j if j >= 0 else n_columns + k for k, j in enumerate(found)], kind='stable')
+    arrays['A'] = arrays['A'][:, order]
+    
+    for key in ['c', 'col_lb', 'col_ub', 'integrality']:
+        arrays[key] = arrays[key][order]
+    
+    start = None
+    
+    if warm_start and column_map['start'] is not None:
+        start = np.zeros(len(names))
+        start[column_map['start']['columns']] = column_map['start']['values']
+    
+    library = {key: np.asarray(column_map[key]) for key in COLUMN_MAP_KEYS}
+    library['candidate_counts'] = column_map['candidate_counts']
+    build_time = time.time() - read_start
+    
+    # Record the solver progress
+    points, record = progress_recorder(progress)
+    
+    result = solve(arrays, solver=solver, verbose=verbose, time_limit=time_limit, threads=threads, start=start,
+                   progress=record)
+    
+    return library_solution(result, arrays, library, column_map['n_var_pos'], build_time, points), column_map
+
+
+def bin_limits(lib_lim, n_bins=1e3):
     if n_bins < lib_lim:
         n_bins = int(n_bins)
     else:
@@ -98,20 +479,79 @@ def bin_oligo_count(lib_lim, n_templates, G, D, n_bins=1e3):
     bin_upper_lim = np.log(np.linspace(1, lib_lim, num=n_bins))
     bin_lower_lim = np.array([bin_upper_lim[i-1] if i > 0 else first_lower_bin for i in range(n_bins)])
     
-    bins = cvxpy.Variable((n_templates, n_bins), boolean=True)
-    
-    constraints = []
+    return bin_lower_lim, bin_upper_lim
+
+
+def bin_oligo_count(model, lib_lim, G, log_deg, n_bins=1e3, bin_upper_lim=None):
+    # bin_upper_lim optionally replaces the uniform bins of bin_limits
+    # with the given increasing log library sizes
+    if bin_upper_lim is None:
+        bin_lower_lim, bin_upper_lim = bin_limits(lib_lim, n_bins)
+    else:
+        bin_lower_lim = np.concatenate([[0], bin_upper_lim[:-1]])
+        
+    n_bins = len(bin_upper_lim)
+    n_templates = len(G)
+    bins = model.add_variables((n_templates, n_bins))
     
-    for s in range(len(G)):
-        log_n_seq = cvxpy.sum(G[s] * cvxpy.log(cvxpy.sum(D, axis=1)))
+    for s in range(n_templates):
+        # log_n_seq <= log(lib_lim)
+        model.add_constraints([(log_deg[None, :], G[s])], ub=np.log(lib_lim))
         
-        constraints.append(log_n_seq <= cvxpy.log(lib_lim))
+        # bin_lower_lim @ bins <= log_n_seq <= bin_upper_lim @ bins
+        model.add_constraints([(log_deg[None, :], G[s]), (-bin_lower_lim[None, :], bins[s])], lb=0)
+        model.add_constraints([(log_deg[None, :], G[s]), (-bin_upper_lim[None, :], bins[s])], ub=0)
+        model.add_constraints([(np.ones((1, n_bins)), bins[s])], lb=1, ub=1)
         
-        constraints.append(bins[s, :] * bin_lower_lim <= log_n_seq)
-        constraints.append(bins[s, :] * bin_upper_lim >= log_n_seq)
-        constraints.append(cvxpy.sum(bins[s, :]) == 1)
+    # Constrain the binned total library size
+    model.add_constraints([(np.tile(np.exp(bin_upper_lim), n_templates)[None, :], bins)], ub=lib_lim)
         
-    lib_size = cvxpy.sum(bins * np.exp(bin_upper_lim))
-    constraints.append(lib_size <= lib_lim)
+    return bins
+
+
+def log_oligo_count(model, lib_lim, G, log_deg, n_bins=1e3, encoding='log'):
+    # The bins of bin_limits are uniform in the library size, so the
+    # size of bin k is exp(bin_upper_lim[k]) = 1 + k * width and the total
+    # library size is linear in the bin index k of every template. As
+    # bin_upper_lim is concave in k, log_n_seq <= bin_upper_lim[k] is the
+    # intersection of the secants between consecutive bins. With
+    # encoding='log', k is an integer made of log2(n_bins) binaries; with
+    # encoding='pwl', k is continuous, so that the size of every template
+    # is interpolated between the bins.
+    if encoding not in ('log', 'pwl'):
+        raise ValueError('Unknown size encoding {}, expected log or pwl.'.format(encoding))
+    
+    bin_upper_lim = bin_limits(lib_lim, n_bins)[1]
+    n_bins = len(bin_upper_lim)
+    n_templates = len(G)
+    width = (lib_lim - 1) / max(n_bins - 1, 1)
+    
+    log_n_seq = model.add_variables(n_templates, lb=0, ub=np.log(lib_lim), integer=False)
+    k = model.add_variables(n_templates, lb=0, ub=n_bins - 1, integer=False)
+    
+    slopes = np.diff(bin_upper_lim)
+    intercepts = bin_upper_lim[:-1] - slopes * np.arange(n_bins - 1)
+    
+    if encoding == 'log':
+        n_bits = max(1, int(np.ceil(np.log2(n_bins))))
+        bits = model.add_variables((n_templates, n_bits))
+    else:
+        bits = None
+    
+    for s in range(n_templates):
+        # log_n_seq = log_deg @ G
+        model.add_constraints([(log_deg[None, :], G[s]), (-np.ones((1, 1)), log_n_seq[[s]])], lb=0, ub=0)
         
-    return constraints, lib_size
+        # log_n_seq <= slopes * k + intercepts
+        model.add_constraints([(np.ones((n_bins - 1, 1)), log_n_seq[[s]]), (-slopes[:, None], k[[s]])],
+                              ub=intercepts)
+        
+        # k = sum of 2^m * bits[m]
+        if bits is not None:
+            model.add_constraints([(np.ones((1, 1)), k[[s]]), (-2.0 ** np.arange(n_bits)[None, :], bits[s])],
+                                  lb=0, ub=0)
+    
+    # Constrain the total library size
+    model.add_constraints([(np.full((1, n_templates), width), k)], ub=lib_lim - n_templates)
+    
+    return log_n_seq, k, bits
@@ -0,0 +1,65 @@
+import numpy as np
+from .datasets import D, D_hat
+
+def target_matrix(O):
+    # Residue index of every target at every variable position, also
+    # accepting the dictionary of one-hot matrices of older versions
+    if isinstance(O, dict):
+        return np.stack([np.argmax(O[i], axis=1) for i in range(len(O))]).astype(np.uint8)
+    
+    return np.asarray(O, dtype=np.uint8)
+
+
+def prepare_targets(O):
+    residues = target_matrix(O)
+    
+    # Residues observed at every variable position, the one-hot targets
+    # summed over the targets
+    observed = np.zeros((residues.shape[1], D.shape[1]), dtype=bool)
+    observed[np.arange(residues.shape[1]), residues] = True
+    
+    # Collapse identical targets into a single target weighted by
+    # its number of copies
+    residues, target_idx, weights = np.unique(residues, axis=0, return_inverse=True, return_counts=True)
+    
+    return residues, target_idx.reshape(-1), weights, observed
+
+
+def codon_classes(observed, D=D, D_hat=D_hat):
+    # Group the codons by the observed amino acids they cover and
+    # keep the least degenerate codon of each group, preferring
+    # codons with fewer unobserved residues and real codons over
+    # the gap codon on ties
+    log_deg = np.log(np.sum(D, axis=1))
+    order = np.lexsort((D_hat[:, -1], np.sum(D_hat, axis=1), log_deg))
+    
+    _, first = np.unique(D_hat[order][:, observed], axis=0, return_index=True)
+    
+    return np.sort(order[first])
+
+
+def prune_codons(observed, D=D, D_hat=D_hat):
+    # For every position (row of observed), keep one codon per class
+    # of observed coverage, then drop the codons that cover none of
+    # the observed residues and the codons dominated by another codon
+    # covering a superset of their residues at equal or lower degeneracy
+    log_deg = np.log(np.sum(D, axis=1))
+    
+    candidates = []
+    
+    for position_observed in observed:
+        keep = codon_classes(position_observed, D, D_hat)
+        cover = D_hat[keep][:, position_observed]
+        
+        covers_any = cover.any(axis=1)
+        keep, cover = keep[covers_any], cover[covers_any]
+        
+        # subset[i, j] is True if codon i covers a subset of codon j
+        subset = (cover @ (1 - cover).T) == 0
+        np.fill_diagonal(subset, False)
+        
+        dominated = np.any(subset & (log_deg[keep][None, :] <= log_deg[keep][:, None]), axis=1)
+        
+        candidates.append(keep[~dominated])
+        
+    return candidates
@@ -0,0 +1,118 @@
+import contextlib
+import resource
+import sys
+import time
+import tracemalloc
+
+# Phases of a run, in the order they happen
+PHASES = ['read_msa', 'read_model', 'encode', 'build_model', 'warm_start', 'canonicalize', 'solve', 'postprocess']
+
+# Phase records of the running profile, or None if not profiling
+_profile = None
+
+
+def _peak_rss():
+    # Peak resident set size in MB since the last reset, or of the whole
+    # process where it cannot be reset
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 2 ** 10
+    except OSError:
+        pass
+
+    # ru_maxrss is in bytes on macOS and in kB elsewhere
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+
+
+def _reset_peak_rss():
+    # Reset the peak resident set size (Linux only). Returns whether the
+    # peak could be reset
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def start(trace=True):
+    """Start recording the time, peak resident set size and, if trace,
+    peak traced Python memory of every phase. Tracing slows down memory
+    allocations, so the times are more accurate without it."""
+    global _profile
+
+    _profile = {'phases': {}, 'active': None, 'start': time.perf_counter(), 'peak_rss': _peak_rss(),
+                'rss_per_phase': True}
+
+    if trace:
+        tracemalloc.start()
+
+
+def _traced_peak():
+    # Peak traced memory in MB since the last reset, or None if not tracing
+    return tracemalloc.get_traced_memory()[1] / 2 ** 20 if tracemalloc.is_tracing() else None
+
+
+def stop():
+    """Stop profiling and return the profile of the run.
+
+    Every phase has its number of calls, total time in seconds, and
+    largest peak resident set size and traced Python memory (None if not
+    tracing) in MB over its calls. The peak resident set size is the peak
+    of the whole process up to the end of the phase where it cannot be
+    reset per phase (rss_per_phase false).
+    """
+    global _profile
+
+    profile, _profile = _profile, None
+    peak_traced = _traced_peak()
+    tracemalloc.stop()
+
+    order = {name: i for i, name in enumerate(PHASES)}
+    phases = dict(sorted(profile['phases'].items(), key=lambda item: order.get(item[0], len(PHASES))))
+
+    return {
+        'phases': phases,
+        'total_time': time.perf_counter() - profile['start'],
+        'peak_rss_mb': max([profile['peak_rss'], _peak_rss()] + [p['peak_rss_mb'] for p in phases.values()]),
+        'peak_traced_mb': None if peak_traced is None else
+                          max([peak_traced] + [p['peak_traced_mb'] for p in phases.values()]),
+        'rss_per_phase': profile['rss_per_phase']
+    }
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Record a phase of the run if profiling, as a context manager or a
+    function decorator. Phases within a phase are part of the outer one."""
+    if _profile is None or _profile['active'] is not None:
+        yield
+        return
+
+    profile = _profile
+    profile['active'] = name
+    profile['peak_rss'] = max(profile['peak_rss'], _peak_rss())
+    profile['rss_per_phase'] &= _reset_peak_rss()
+    start_time = time.perf_counter()
+
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start_time
+        peak_traced = _traced_peak()
+        record = profile['phases'].setdefault(name, {'calls': 0, 'time': 0.0, 'peak_rss_mb': 0.0,
+                                                     'peak_traced_mb': None if peak_traced is None else 0.0})
+        record['calls'] += 1
+        record['time'] += elapsed
+        record['peak_rss_mb'] = max(record['peak_rss_mb'], _peak_rss())
+
+        if peak_traced is not None:
+            record['peak_traced_mb'] = max(record['peak_traced_mb'], peak_traced)
+
+        profile['active'] = None
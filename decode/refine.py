@@ -0,0 +1,82 @@
+import numpy as np
+from .datasets import D
+from .ilp import bin_limits, build_library, solve_library
+
+def refine_bins(bin_upper_lim, log_n_seq, lib_lim, tolerance=0.01, n_steps=10):
+    """Add bins around the given template log library sizes.
+
+    Every size gets a bin of its own and n_steps bins on either side, each
+    a factor (1 + tolerance) apart, on top of the coarse bin_upper_lim.
+    """
+    steps = np.log1p(tolerance * np.arange(-n_steps, n_steps + 1))
+    fine = (np.asarray(log_n_seq)[:, None] + steps[None, :]).reshape(-1)
+    fine = fine[(fine > 0) & (fine < np.log(lib_lim))]
+
+    return np.unique(np.concatenate([bin_upper_lim, fine]))
+
+
+def binned_size(bin_upper_lim, log_n_seq):
+    # Total library size of the templates rounded up to their bins
+    b = np.searchsorted(bin_upper_lim, np.asarray(log_n_seq) - 1e-9)
+    return np.sum(np.exp(bin_upper_lim[b]))
+
+
+def solve_refined(O, lib_lim, n_templates, bins=100, tolerance=0.01, max_iterations=5, verbose=True,
+                  symmetry='none', **kwargs):
+    """Solve a multi-template design with adaptive library size bins.
+
+    The first solve uses bins uniform bins. Every next solve adds bins
+    around the size of each template of the previous library (see
+    refine_bins) and starts from that library, which the new bins make
+    exact. This stops once the binned total library size is within
+    tolerance of the exact one, or after max_iterations solves. Other
+    keyword arguments are passed on to solve_library.
+
+    Returns the solution of the last solve, with the binned and exact
+    total library size of every solve in 'refinements', and the solver
+    progress of all solves in 'progress', timed from the first solve.
+    """
+    library = build_library(O, n_templates, verbose=verbose, symmetry=symmetry)
+    bin_upper_lim = bin_limits(lib_lim, bins)[1]
+    coarse = bin_upper_lim
+    previous = None
+    refinements = []
+    build_time, solve_time = library['build_time'], 0
+    progress = kwargs.pop('progress', None)
+    points = []
+
+    for i in range(max_iterations):
+        # Time the progress of every solve from the start of the first
+        offset = solve_time
+        shift = lambda point: dict(point, time=point['time'] + offset)
+
+        solution = solve_library(O, lib_lim, n_templates, bins=bins, verbose=verbose, library=library,
+                                 start_codons=previous, bin_grid=bin_upper_lim,
+                                 progress=None if progress is None else lambda point: progress(shift(point)),
+                                 **kwargs)
+        points.extend(shift(point) for point in solution['progress'])
+        build_time += solution['build_time'] - library['build_time']
+        solve_time += solution['solve_time']
+
+        previous = np.argmax(solution['codon_selection'], axis=2)
+        log_n_seq = np.sum(np.log(np.sum(D[previous], axis=2)), axis=1)
+
+        exact = np.sum(np.exp(log_n_seq))
+        binned = binned_size(bin_upper_lim, log_n_seq)
+        refinements.append({'n_bins': len(bin_upper_lim), 'binned_size': float(binned), 'exact_size': float(exact)})
+
+        if verbose:
+            print('Refinement {}: {} bins, binned size {:g}, exact size {:g}.\n'.format(
+                i + 1, len(bin_upper_lim), binned, exact))
+
+        if binned - exact <= tolerance * exact:
+            break
+
+        bin_upper_lim = refine_bins(coarse, log_n_seq, lib_lim, tolerance)
+
+    solution['build_time'] = build_time
+    solution['solve_time'] = solve_time
+    solution['refinements'] = refinements
+    solution['progress'] = points
+
+    return solution
@@ -0,0 +1,226 @@
+import functools
+import math
+from collections import Counter
+import numpy as np
+from . import datasets
+from .datasets import AA_IDX
+from .seq_utils import codon_counts, count_log_probs, encode_seqs
+
+
+def library_counts(data):
+    """(n_sublibs x n_var_pos x n_aas) number of codons of every amino acid
+    at every variable position of the library of a DeCoDe output file.
+
+    The counts come from the `codon_keys` of the output, or are rebuilt
+    from `parsed_lib` for older output files and SwiftLib results.
+    """
+    if 'codon_keys' in data:
+        return codon_counts(data['codon_keys'])
+
+    fixed_positions = {int(j): aa for j, aa in data['fixed_positions'].items()}
+    variable_positions = data['variable_positions']
+    length = len(fixed_positions) + len(variable_positions)
+
+    # parse_lib leaves out the gap positions of every sublibrary
+    kept = [j for j in range(length) if fixed_positions.get(j) != '-']
+    column = {j: i for i, j in enumerate(variable_positions)}
+
+    counts = np.zeros((len(data['parsed_lib']), len(variable_positions), len(AA_IDX)))
+
+    for s, sublib in enumerate(data['parsed_lib']):
+        if len(sublib) != len(kept):
+            raise ValueError('Sublibrary {} has gaps at variable positions, which cannot be recovered '
+                             'from parsed_lib. Rerun the design to store its codon_keys.'.format(s))
+
+        for j, res in zip(kept, sublib):
+            if j not in column:
+                continue
+
+            # A single residue is listed without its codon, so it counts as
+            # one codon even if its codon is degenerate
+            aa_dist = datasets.codon_aa_mapping[next(iter(res.values()))[0]] if isinstance(res, dict) else {res: 1}
+
+            for aa, count in aa_dist.items():
+                counts[s, column[j], AA_IDX.index(aa)] = count
+
+    return counts
+
+
+def sublibrary_weights(counts):
+    # Fraction of the DNA library in every sublibrary
+    log_sizes = np.sum(np.log(np.sum(counts, axis=2)), axis=1)
+    return np.exp(log_sizes - np.logaddexp.reduce(log_sizes))
+
+
+def residue_frequencies(counts):
+    # (n_var_pos x n_aas) expected frequency of every amino acid at every
+    # variable position, weighted by the codons that encode it
+    weights = sublibrary_weights(counts)
+    return np.einsum('s,spa->pa', weights, counts / np.sum(counts, axis=2, keepdims=True))
+
+
+def sample_library(counts, n_draws, batch_size=1000000, seed=None):
+    """Draw n_draws variants from the library, with every codon equally
+    likely, in batches of at most batch_size.
+
+    Yields (batch_size x n_var_pos) uint8 matrices of residue indices into
+    AA_IDX, so that the library is never held in memory.
+    """
+    rng = np.random.default_rng(seed)
+    weights = sublibrary_weights(counts)
+
+    # Only the degenerate positions of a sublibrary are drawn. The codon
+    # count of every degenerate position divides the least common multiple
+    # of the counts, so a uniform draw below that multiple picks an entry
+    # of a table with every codon repeated equally often
+    sublibs = []
+
+    for sublib_counts in counts.astype(np.int64):
+        degenerate = np.flatnonzero(np.count_nonzero(sublib_counts, axis=1) > 1)
+        totals = np.sum(sublib_counts[degenerate], axis=1)
+        n_entries = functools.reduce(lambda a, b: a * b // math.gcd(a, b), totals.tolist(), 1)
+
+        lookup = np.repeat(np.tile(np.arange(len(AA_IDX), dtype=np.uint8), len(degenerate)),
+                           (sublib_counts[degenerate] * (n_entries // totals)[:, None]).ravel())
+
+        sublibs.append((np.argmax(sublib_counts, axis=1).astype(np.uint8), degenerate, lookup,
+                        np.arange(len(degenerate)) * n_entries, n_entries))
+
+    for start in range(0, n_draws, batch_size):
+        n_batch = min(batch_size, n_draws - start)
+        sublib_sizes = rng.multinomial(n_batch, weights)
+        batch = np.empty((n_batch, counts.shape[1]), dtype=np.uint8)
+
+        first = 0
+        for size, (constant, degenerate, lookup, offsets, n_entries) in zip(sublib_sizes, sublibs):
+            rows = batch[first:first + size]
+            rows[:] = constant
+
+            if len(degenerate):
+                draws = rng.integers(0, n_entries, size=(size, len(degenerate)),
+                                     dtype=np.uint16 if n_entries <= 2 ** 16 else np.uint32)
+                rows[:, degenerate] = lookup[offsets + draws]
+
+            first += size
+
+        # Mix the sublibraries, which were drawn in blocks
+        yield batch[rng.permutation(n_batch)]
+
+
+def _disjoint(sets):
+    # Whether no sequence is in two sublibraries, which is the case if every
+    # pair of sublibraries has no residue in common at some position
+    return all(not np.all(np.any(sets[a] & sets[b], axis=1))
+               for a in range(len(sets)) for b in range(a + 1, len(sets)))
+
+
+def probability_classes(counts):
+    """Distinct sequence probabilities of a library whose sublibraries
+    share no sequence, with the number of sequences of each.
+
+    The codon counts of a sequence multiply over its positions, so the
+    classes are built position by position from the distinct counts at
+    every position rather than by listing the sequences.
+    """
+    if not _disjoint(counts > 0):
+        raise ValueError('The sublibraries share sequences.')
+
+    weights = sublibrary_weights(counts)
+    classes = Counter()
+
+    for weight, sublib_counts in zip(weights, counts.astype(np.int64)):
+        # Number of sequences with every product of codon counts
+        products = {1: 1}
+
+        for position in sublib_counts:
+            multiplicity = Counter(position[position > 0].tolist())
+            products_next = Counter()
+
+            for product, n_seqs in products.items():
+                for count, n_aas in multiplicity.items():
+                    products_next[product * count] += n_seqs * n_aas
+
+            products = products_next
+
+        log_total = np.sum(np.log(np.sum(sublib_counts, axis=1)))
+
+        for product, n_seqs in products.items():
+            classes[float(np.exp(np.log(weight) + math.log(product) - log_total))] += n_seqs
+
+    return classes
+
+
+def expected_unique(counts, n_draws, batch_size=1000000, seed=None):
+    """Expected number of distinct variants in n_draws draws from the
+    library (e.g. the transformants of a library of a given size).
+
+    Exact for libraries whose sublibraries share no sequence, and
+    estimated from one sample of n_draws variants otherwise.
+    """
+    try:
+        classes = probability_classes(counts)
+    except ValueError:
+        # Compare whole variants as single opaque values, which sorts much
+        # faster than unique rows
+        row = np.dtype((np.void, counts.shape[1]))
+        seen = np.empty(0, dtype=row)
+
+        for batch in sample_library(counts, n_draws, batch_size, seed):
+            seen = np.union1d(seen, np.ascontiguousarray(batch).view(row).ravel())
+
+        return float(len(seen))
+
+    # Sequences with probability p are drawn at least once with
+    # probability 1 - (1 - p)^n_draws
+    return float(sum(n_seqs * -np.expm1(n_draws * np.log1p(-p)) for p, n_seqs in classes.items()))
+
+
+def target_coverage(counts, targets, n_draws):
+    """Fraction of the draws that land on a target, and the expected
+    number of distinct targets drawn at least once in n_draws draws."""
+    residues = np.unique(encode_seqs(targets), axis=0)
+    p = np.exp(count_log_probs(counts, residues))
+
+    return float(np.sum(p)), float(np.sum(-np.expm1(n_draws * np.log1p(-p))))
+
+
+def library_stats(data, n_draws, batch_size=1000000, seed=None):
+    """Expected diversity statistics of the library of a DeCoDe output
+    file for a transformation of n_draws variants."""
+    counts = library_counts(data)
+    on_target, targets_drawn = target_coverage(counts, data['sequences'], n_draws)
+
+    return {
+        'n_draws': n_draws,
+        'expected_unique': expected_unique(counts, n_draws, batch_size, seed),
+        'unique_exact': _disjoint(counts > 0),
+        'on_target_fraction': on_target,
+        'expected_targets_drawn': targets_drawn,
+        'n_distinct_targets': len(set(data['sequences'])),
+        'residue_frequencies': {int(j): {aa: float(f) for aa, f in zip(AA_IDX, freqs) if f > 0}
+                                for j, freqs in zip(data['variable_positions'], residue_frequencies(counts))}
+    }
+
+
+def write_fasta(handle, batches, data):
+    # Write drawn variants to a binary file handle as full-length aligned
+    # sequences, one batch at a time
+    fixed_positions = {int(j): aa for j, aa in data['fixed_positions'].items()}
+    variable_positions = data['variable_positions']
+    length = len(fixed_positions) + len(variable_positions)
+
+    template = np.full(length + 1, ord('\n'), dtype=np.uint8)
+    template[list(fixed_positions)] = np.frombuffer(''.join(fixed_positions.values()).encode(), dtype=np.uint8)
+    aa_chars = np.frombuffer(AA_IDX.encode(), dtype=np.uint8)
+
+    n_written = 0
+    for batch in batches:
+        seqs = np.tile(template, (len(batch), 1))
+        seqs[:, variable_positions] = aa_chars[batch]
+        lines = seqs.tobytes()
+
+        handle.write(b''.join(b'>Variant%d\n%s' % (n_written + i, lines[i * (length + 1):(i + 1) * (length + 1)])
+                              for i in range(len(batch))))
+        n_written += len(batch)
+
+    return n_written
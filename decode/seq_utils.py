@@ -1,35 +1,75 @@
 import numpy as np
-import pickle
-from Bio import AlignIO as aln
-from .datasets import all_codons, codon_aa_mapping
+from . import datasets
+from .datasets import AA_IDX
+from .profiling import phase
 
 #################################################
 #### Datasets and  data generation functions ####
 #################################################
 
-def generate_seqs(count, length, dist=None):
+def generate_targets(n_targets, length, n_var_pos=None, dist=None, aa_freqs=None, mutations=1, seed=None):
+    """Generate n_targets distinct sequences of the given length that
+    descend from a random wild type, as a random phylogeny.
+    
+    The targets are built in rounds, in which every target so far can
+    have one child, so that the number of targets doubles every round.
+    A child has its parent's sequence with 1 + Poisson(mutations - 1)
+    substitutions, at positions drawn from dist (by default exponentially
+    distributed weights) among n_var_pos random positions (all positions
+    by default), to residues drawn from aa_freqs over the 20 amino acids
+    (uniform by default). Children identical to an earlier target are
+    dropped.
+    
+    Returns an (n_targets x length) uint8 matrix of residue characters.
+    """
+    rng = np.random.default_rng(seed)
+    aas = np.frombuffer(AA_IDX[:20].encode(), dtype=np.uint8)
+    
+    positions = np.arange(length) if n_var_pos is None else np.sort(rng.choice(length, n_var_pos, replace=False))
+    
     if dist is None:
-        dist = np.random.exponential(size=length)
-        dist /= dist.sum()
-    
-    seqs = []
-    aa_choices = np.array(list('ACDEFGHIKLMNPQRSTVWY'))
-    wt = ''.join([i for i in np.random.choice(aa_choices, length)])
-    seqs.append(wt)
-    
-    while len(seqs) < count:
-        seq = np.random.choice(seqs)
-        pos = np.random.choice(list(range(length)), p=dist)
-        mutant = np.random.choice(aa_choices, 1)[0]
-        seq_list = list(seq)
-        seq_list[pos] = mutant
-        new_seq = ''.join(seq_list)
-        if new_seq not in seqs:
-            seqs.append(new_seq)
+        dist = rng.exponential(size=len(positions))
+    
+    dist = np.asarray(dist, dtype=float) / np.sum(dist)
+    
+    seqs = np.empty((n_targets, length), dtype=np.uint8)
+    seqs[0] = rng.choice(aas, length, p=aa_freqs)
+    n_seqs = 1
+    row = np.dtype((np.void, length))
+    stalled = 0
+    
+    while n_seqs < n_targets:
+        # Every target so far can have a child in this round
+        children = seqs[rng.integers(0, n_seqs, min(n_seqs, n_targets - n_seqs))]
+        n_mutations = 1 + rng.poisson(max(mutations - 1, 0), len(children))
+        
+        for j in range(n_mutations.max()):
+            mutated = np.flatnonzero(n_mutations > j)
+            children[mutated, positions[rng.choice(len(positions), len(mutated), p=dist)]] = \
+                rng.choice(aas, len(mutated), p=aa_freqs)
+        
+        # Keep the first copy of every child that is not already a target
+        keys = np.concatenate([seqs[:n_seqs], children]).view(row).ravel()
+        first = np.unique(keys, return_index=True)[1]
+        new = children[np.sort(first[first >= n_seqs]) - n_seqs]
+        
+        seqs[n_seqs:n_seqs + len(new)] = new
+        n_seqs += len(new)
+        
+        # Stop if the variable positions cannot give more distinct targets
+        stalled = 0 if len(new) else stalled + 1
         
+        if stalled == 100:
+            raise ValueError('Only {} distinct targets could be generated.'.format(n_seqs))
+    
     return seqs
 
 
+def generate_seqs(count, length, dist=None, seed=None):
+    # Distinct sequences with one substitution from an earlier sequence
+    return [seq.tobytes().decode('ascii') for seq in generate_targets(count, length, dist=dist, seed=seed)]
+
+
 def gen_fasta(sequences):
     fasta = []
     i=0
@@ -45,101 +85,233 @@ def gen_fasta(sequences):
 #### Input sequence processing functions ####
 #############################################
 
-def process_msa(filename, filetype):
-    with open(filename, 'r') as handle:
-        sequences = aln.read(handle, filetype)
+CLUSTAL_HEADERS = (b'CLUSTAL', b'PROBCONS', b'MUSCLE', b'MSAPROBS', b'Kalign', b'Biopython')
+
+def open_alignment(filename):
+    # Open an alignment file for binary reading, decompressing it if it
+    # starts with the gzip magic number
+    with open(filename, 'rb') as handle:
+        compressed = handle.read(2) == b'\x1f\x8b'
+    
+    if compressed:
+        import gzip
+        return gzip.open(filename, 'rb')
+    
+    return open(filename, 'rb')
+
+
+def alignment_format(filename):
+    # FASTA if the first non-blank line is a FASTA header, else clustal
+    with open_alignment(filename) as handle:
+        for line in handle:
+            if line.strip():
+                return 'fasta' if line.startswith(b'>') else 'clustal'
+    
+    return 'clustal'
+
+
+def _clustal_blocks(handle):
+    # Yield the sequence lines of every block of a clustal alignment,
+    # skipping the header, the blank lines and the consensus lines
+    header = handle.readline()
+    
+    if not header.strip() or header.split()[0] not in CLUSTAL_HEADERS:
+        raise ValueError('Not a clustal alignment: {!r}'.format(header[:40]))
+    
+    block = []
+    
+    for line in handle:
+        if line[:1].isspace():
+            if block:
+                yield block
+                block = []
+    
+            continue
+    
+        fields = line.split()
     
-    fixed_positions = {}
-    variable_positions = []
+        if len(fields) < 2 or len(fields) > 3:
+            raise ValueError('Could not parse alignment line: {!r}'.format(line[:80]))
+    
+        block.append(fields[1])
+    
+    if block:
+        yield block
+
 
-    for position in range(len(sequences[0])):
-        residues = list(set([seq[position] for seq in sequences]))
-        if len(residues) == 1:
-            fixed_positions[position] = residues[0]
+def _fasta_records(handle):
+    # Yield the sequence of every FASTA record
+    record = None
+    
+    for line in handle:
+        if line.startswith(b'>'):
+            if record is not None:
+                yield b''.join(record)
+            record = []
+    
+        elif record is not None:
+            record.append(line.strip())
+    
+        elif line.strip():
+            raise ValueError('Not a FASTA alignment: {!r}'.format(line[:40]))
+    
+    if record is not None:
+        yield b''.join(record)
+
+
+def _block_matrix(sequences, filename):
+    # Stack aligned byte strings into a uint8 matrix
+    if not sequences or len(set(map(len, sequences))) > 1:
+        raise ValueError('Sequences of {} have different lengths.'.format(filename))
+    
+    return np.frombuffer(b''.join(sequences), dtype=np.uint8).reshape(len(sequences), -1)
+
+
+def read_alignment(filename, filetype):
+    """Read a clustal or FASTA alignment, which may be gzip-compressed,
+    in a single pass.
+    
+    Returns an (n_seqs x length) uint8 matrix of the alignment characters.
+    Other Biopython alignment formats are read through Bio.AlignIO.
+    """
+    if filetype == 'clustal':
+        with open_alignment(filename) as handle:
+            rows = [_block_matrix(block, filename) for block in _clustal_blocks(handle)]
         
-        else:
-            variable_positions.append(position)
+        if not rows or len(set(len(block) for block in rows)) > 1:
+            raise ValueError('Blocks of {} have different numbers of sequences.'.format(filename))
         
-    out_seqs = [''.join([seq[pos] for pos in variable_positions]) for seq in sequences]
+        return np.concatenate(rows, axis=1)
+    
+    elif filetype == 'fasta':
+        with open_alignment(filename) as handle:
+            return _block_matrix(list(_fasta_records(handle)), filename)
+    
+    # Biopython is slow to import, so only load it for other formats
+    import io
+    from Bio import AlignIO as aln
+    
+    with open_alignment(filename) as handle:
+        sequences = aln.read(io.TextIOWrapper(handle), filetype)
+    
+    return _block_matrix([str(seq.seq).encode() for seq in sequences], filename)
+
+
+@phase('read_msa')
+def process_msa(filename, filetype=None):
+    # Positions with the same character in every sequence are fixed. The
+    # format is detected from the contents unless filetype is given
+    alignment = read_alignment(filename, filetype or alignment_format(filename))
+    variable = np.any(alignment != alignment[0], axis=0)
+    
+    fixed_positions = {int(p): chr(alignment[0, p]) for p in np.flatnonzero(~variable)}
+    variable_positions = np.flatnonzero(variable).tolist()
+    
+    out_seqs = [row.tobytes().decode('ascii') for row in alignment[:, variable]]
     
     return (fixed_positions, variable_positions, out_seqs)
 
-def create_O(sequences):
-    n_targets = len(sequences)
-    n_var_pos = len(sequences[0])
+# Index of every character in AA_IDX, and 255 for other characters
+AA_CODES = np.full(256, 255, dtype=np.uint8)
+AA_CODES[np.frombuffer(AA_IDX.encode(), dtype=np.uint8)] = np.arange(len(AA_IDX))
+
+def encode_seqs(sequences):
+    # (n_seqs x n_var_pos) uint8 matrix of the amino acid index of every residue
+    length = len(sequences[0]) if len(sequences) else 0
+    codes = AA_CODES[np.frombuffer(''.join(sequences).encode('ascii'), dtype=np.uint8)]
     
-    O = {i: np.zeros((len(sequences[0]), 22)) for i in range(len(sequences))}
+    if len(codes) != len(sequences) * length:
+        raise ValueError('Sequences have different lengths.')
     
-    aa_idx = 'ACDEFGHIKLMNPQRSTVWY*-'
-    for i in O.keys():
-        seq = sequences[i]
-        for j, aa in enumerate(seq):
-            O[i][j, aa_idx.index(aa)] = 1
-            
-    return (n_targets, n_var_pos, O)
+    if np.any(codes == 255):
+        raise ValueError('Residue {!r} is not one of {}.'.format(''.join(sequences)[np.argmax(codes == 255)], AA_IDX))
+    
+    return codes.reshape(len(sequences), length)
+
+
+@phase('encode')
+def create_O(sequences):
+    # The targets are encoded as an (n_targets x n_var_pos) uint8 matrix of
+    # residue indices into AA_IDX, rather than one-hot matrices
+    O = encode_seqs(sequences)
+    
+    return (O.shape[0], O.shape[1], O)
 
 #######################################
 #### Solution extraction functions ####
 #######################################
 
-def retrieve_codons(codon_selection, codons=all_codons):
-    keys = [[all_codons[i] for i in np.argmax(codon_selection, axis=2)[j]] for j in range(len(codon_selection))]
-    return keys
-
-
-def calc_num_seqs(keys, codon_aa_mapping=codon_aa_mapping):
-    oligo_products = []
-    
-    for key_set in keys:
-        oligo_products.append(np.product([len(codon_aa_mapping[key[0]]) for key in key_set]))
+def retrieve_codons(codon_selection, codons=None):
+    if codons is None:
+        codons = datasets.all_codons
     
-    return np.sum(oligo_products)
+    keys = [[codons[i] for i in np.argmax(codon_selection, axis=2)[j]] for j in range(len(codon_selection))]
+    return keys
 
 
-def calc_seq_prob(sequence, codon_keys, codon_aa_mapping=codon_aa_mapping):
+_default_counts = None
 
-    in_sl = []
-    total_seqs = []
+def codon_counts(codon_keys, codon_aa_mapping=None):
+    # (n_sublibs x n_var_pos x n_aas) matrix of the number of codons of
+    # each amino acid for the degenerate codon at every position
+    global _default_counts
     
-    for key_set in codon_keys:
+    if codon_aa_mapping is None:
+        # Read the default counts straight from the codon tables, once
+        if _default_counts is None:
+            keys = datasets.load_array('codon_keys').astype(str).tolist()
+            count_matrix = np.array(datasets.load_array('codon_aa_counts'), dtype=float)
+            _default_counts = ({key: i for i, key in enumerate(keys)}, count_matrix)
         
-        seq_total = 1
-        p_i = 1
+        row, count_matrix = _default_counts
         
-        for i, aa in enumerate(sequence):
-            aa_dist = codon_aa_mapping[key_set[i][0]]
-            
-            total_aa_count = np.sum([aa_dist[key] for key in aa_dist])
-            
-            seq_total *= total_aa_count
-            p_i *= aa_dist[aa]
-            
-        in_sl.append(p_i)
-        total_seqs.append(seq_total)
+    else:
+        # Custom mappings may be changed between calls, so they are not cached
+        row = {key: i for i, key in enumerate(codon_aa_mapping)}
+        count_matrix = np.zeros((len(row), len(AA_IDX)))
         
-    return np.sum(in_sl) / np.sum(total_seqs)
+        for key, aa_dist in codon_aa_mapping.items():
+            for aa, count in aa_dist.items():
+                count_matrix[row[key], AA_IDX.index(aa)] = count
+    
+    return count_matrix[[[row[key[0]] for key in key_set] for key_set in codon_keys]]
 
 
-def calc_prob_on_target(target_seqs, codon_keys, codon_aa_mapping=codon_aa_mapping):
-    p_on_target = 0
-    
-    for seq in target_seqs:
-        p_on_target += calc_seq_prob(seq, codon_keys, codon_aa_mapping=codon_aa_mapping)
-        
-    return p_on_target
+def calc_num_seqs(keys, codon_aa_mapping=None):
+    # Multiply as Python integers, which are exact and cannot overflow
+    n_aas = np.sum(codon_counts(keys, codon_aa_mapping) > 0, axis=2).astype(object)
+    return int(np.sum(np.prod(n_aas, axis=1)))
 
 
-def check_if_seqs_in_soln(sequences, codon_keys, codon_aa_mapping=codon_aa_mapping):
-    in_lib = []
+def count_log_probs(counts, residues):
+    # Log probability of drawing each encoded sequence from the library
+    # with the given codon counts, for all sequences and sublibraries at once
+    n_var_pos = counts.shape[1]
     
-    for seq in sequences:
-        p = calc_seq_prob(seq, codon_keys, codon_aa_mapping)
-        if p > 0:
-            in_lib.append(True)
-        else:
-            in_lib.append(False)
-            
-    return in_lib
+    with np.errstate(divide='ignore'):
+        # (n_sublibs x n_seqs) log count of each sequence in each sublibrary
+        log_in_sl = np.sum(np.log(counts[:, np.arange(n_var_pos)[None, :], residues]), axis=2)
+        log_total_seqs = np.logaddexp.reduce(np.sum(np.log(np.sum(counts, axis=2)), axis=1))
+    
+    return np.logaddexp.reduce(log_in_sl, axis=0) - log_total_seqs
+
+
+def calc_log_seq_probs(sequences, codon_keys, codon_aa_mapping=None):
+    return count_log_probs(codon_counts(codon_keys, codon_aa_mapping), encode_seqs(sequences))
+
+
+def calc_seq_prob(sequence, codon_keys, codon_aa_mapping=None):
+    return np.exp(calc_log_seq_probs([sequence], codon_keys, codon_aa_mapping)[0])
+
+
+def calc_prob_on_target(target_seqs, codon_keys, codon_aa_mapping=None):
+    return np.sum(np.exp(calc_log_seq_probs(target_seqs, codon_keys, codon_aa_mapping)))
+
+
+def check_if_seqs_in_soln(sequences, codon_keys, codon_aa_mapping=None):
+    # A sequence is in the library if its log probability is finite,
+    # which does not underflow for very large libraries
+    return [bool(p) for p in np.isfinite(calc_log_seq_probs(sequences, codon_keys, codon_aa_mapping))]
     
     
 def parse_lib(seq_length, fixed_positions, codon_keys):
@@ -159,7 +331,7 @@ def parse_lib(seq_length, fixed_positions, codon_keys):
                 res = fixed_positions[j]
                 
             else:
-                aa_dist = codon_aa_mapping[key_set[k][0]]
+                aa_dist = datasets.codon_aa_mapping[key_set[k][0]]
                 
                 if np.sum([aa_dist[key] for key in aa_dist]) == 1:
                     res = max(aa_dist)
@@ -175,4 +347,41 @@ def parse_lib(seq_length, fixed_positions, codon_keys):
         parsed_lib.append(parsed_sublib)
     
     return parsed_lib
+
+
+@phase('postprocess')
+def library_output(fixed_positions, variable_positions, sequences, solution, total_time):
+    # Collect the library stats and solution into the output dictionary
+    # written by decode.py
+    solve_time = solution['solve_time']
+    codons = retrieve_codons(solution['codon_selection'])
+    total_seq_length = len(fixed_positions) + len(variable_positions)
+    
+    data = {
+        'solution_optimal': solution['status'] == 'optimal',
+        'fixed_positions': fixed_positions,
+        'variable_positions': variable_positions,
+        'sequences': sequences,
+        'coverage': list(solution['binary_coverage']),
+        'n_var_pos': len(variable_positions),
+        'n_distinct_targets': solution['n_distinct_targets'],
+        'n_covered': int(np.sum(solution['binary_coverage'])),
+        'total_lib_size': int(calc_num_seqs(codons)),
+        'on_target_p': calc_prob_on_target(sequences, codons),
+        'parsed_lib': parse_lib(total_seq_length, fixed_positions, codons),
+        'codon_keys': codons,
+        'codon_candidates': solution['candidate_counts'],
+        'build_time': solution['build_time'],
+        'construct_time': total_time - solve_time,
+        'solve_time': solve_time,
+        'total_time': total_time
+    }
+    
+    if 'refinements' in solution:
+        data['refinements'] = solution['refinements']
+    
+    if 'progress' in solution:
+        data['progress'] = solution['progress']
+    
+    return data
     
\ No newline at end of file
@@ -0,0 +1,28 @@
+import numpy as np
+from .ilp import build_library, solve_library
+
+def sweep_library(O, limits, sublibs, verbose=True, symmetry='none', **kwargs):
+    """Solve the library design over a grid of size limits and sublibrary
+    counts.
+
+    The model of every sublibrary count is built once and solved for the
+    limits in increasing order, starting each solve from the library of
+    the previous (smaller) limit, which is feasible under the larger one.
+    symmetry is passed on to build_library and other keyword arguments
+    are passed on to solve_library.
+
+    Yields a (limit, sublib, solution) tuple for every grid point.
+    """
+    for n_templates in sorted(set(sublibs)):
+        library = build_library(O, n_templates, verbose=verbose, symmetry=symmetry)
+        previous = None
+
+        for lib_lim in sorted(set(limits)):
+            if verbose:
+                print('Solving library size limit {} with {} sublibraries.\n'.format(lib_lim, n_templates))
+
+            solution = solve_library(O, lib_lim, n_templates, verbose=verbose, library=library,
+                                     start_codons=previous, **kwargs)
+            previous = np.argmax(solution['codon_selection'], axis=2)
+
+            yield lib_lim, n_templates, solution
@@ -0,0 +1,48 @@
+import os
+import sys
+import csv
+import time
+import tempfile
+import subprocess
+import numpy as np
+import click
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Time cold starts of the command line interface, each in a new Python
+# process, for the help text and for a trivial optimization
+@click.command()
+@click.option('--repeats', default=10, show_default=True, help='Number of runs of every command.')
+@click.option('--alignment', default=os.path.join(REPO, 'examples', 'fig1', '6o_test-1.aln'), show_default=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--solver', default='highs', show_default=True, help='MILP solver of the trivial run.')
+@click.option('--output', default=None, type=click.Path(dir_okay=False), help='Also write the timings to a CSV file.')
+def benchmark(repeats, alignment, solver, output):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        commands = {
+            'help': ['--help'],
+            'trivial_run': [os.path.abspath(alignment), os.path.join(tmp_dir, 'library.json'),
+                            '--limit', '1000', '--sublib', '1', '--solver', solver, '-q']
+        }
+
+        results = [['command', 'repeats', 'min_time', 'median_time', 'max_time']]
+
+        for name, args in commands.items():
+            times = []
+
+            for _ in range(repeats):
+                start = time.perf_counter()
+                subprocess.run([sys.executable, os.path.join(REPO, 'decode.py')] + args, cwd=tmp_dir,
+                               check=True, stdout=subprocess.DEVNULL)
+                times.append(time.perf_counter() - start)
+
+            results.append([name, repeats, np.min(times), np.median(times), np.max(times)])
+            print('{}: min {:.3f} s, median {:.3f} s, max {:.3f} s'.format(name, *results[-1][2:]))
+
+    if output is not None:
+        with open(output, 'w') as results_file:
+            writer = csv.writer(results_file)
+            writer.writerows(results)
+
+
+if __name__ == '__main__':
+    benchmark()
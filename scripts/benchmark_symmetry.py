@@ -0,0 +1,51 @@
+import os
+import sys
+import csv
+import click
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+sys.path.insert(0, REPO)
+
+from decode.ilp import solve_library
+from decode.backends import SOLVERS
+from decode.seq_utils import process_msa, create_O
+
+# Benchmark the template symmetry breaking options on the multi
+# sublibrary configurations of results/multi_sublib
+@click.command()
+@click.option('--alignment', default=os.path.join(REPO, 'examples', 'gfp', 'gfp_exclude_long.aln'), show_default=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--limit', default=10000000, show_default=True, help='Total library size limit.')
+@click.option('--sublib', default=[1, 2, 3, 4, 8, 12], show_default=True, multiple=True, help='Sublibrary limits to benchmark.')
+@click.option('--symmetry', default=['none', 'size', 'target'], show_default=True, multiple=True, help='Symmetry breaking options to benchmark.')
+@click.option('--bins', default=100, show_default=True)
+@click.option('--time-limit', default=3600, show_default=True, help='Time limit in seconds for every solve.')
+@click.option('--threads', default=0, show_default=True)
+@click.option('--solver', default='gurobi', show_default=True, type=click.Choice(list(SOLVERS)))
+@click.option('--output', default=os.path.join(REPO, 'results', 'multi_sublib', 'symmetry.csv'), show_default=True, type=click.Path(dir_okay=False))
+def benchmark(alignment, limit, sublib, symmetry, bins, time_limit, threads, solver, output):
+    fixed_positions, variable_positions, sequences = process_msa(alignment)
+    n_targets, n_var_pos, O = create_O(sequences)
+
+    results = [['sublibs', 'symmetry', 'status', 'n_covered', 'bound', 'gap', 'build_time', 'solve_time']]
+
+    for n_templates in sublib:
+        for option in symmetry:
+            solution = solve_library(O, limit, n_templates, bins=bins, verbose=False, time_limit=time_limit,
+                                     threads=threads, solver=solver, symmetry=option)
+
+            objective, bound = solution['objective'], solution['bound']
+            gap = (bound - objective) / objective if bound is not None and objective else 'NA'
+
+            results.append([n_templates, option, solution['status'], objective, bound if bound is not None else 'NA',
+                            gap, solution['build_time'], solution['solve_time']])
+
+            print(','.join(str(value) for value in results[-1]))
+
+    with open(output, 'w') as results_file:
+        writer = csv.writer(results_file)
+        writer.writerows(results)
+
+
+if __name__ == '__main__':
+    benchmark()
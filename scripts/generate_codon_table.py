@@ -2,7 +2,6 @@ from Bio.Data.CodonTable import standard_dna_table as sdt
 import itertools as it
 from collections import Counter
 import numpy as np
-import pickle
 
 
 # Define a function to extract the least degenerate codon
@@ -26,7 +25,7 @@ def extract_smallest_codon(codon_map, keys):
                 deg_value = 1
                 
             else:
-                deg_value = np.product([len(deg_nuc_f[nt]) for nt in key])
+                deg_value = np.prod([len(deg_nuc_f[nt]) for nt in key])
             
             if deg_value == min_deg_value:
                 min_keys.append(key)
@@ -119,13 +118,28 @@ if __name__ == '__main__':
             D[idx, aa_idx.index(aa)] = codon_aa_mapping[key][aa]
     
     # Save the D and D_hat matrices for use in the ILP
-    np.save('../data/D', D)
-    np.save('../data/D_hat', D_hat)
+    np.save('../decode/data/D', D)
+    np.save('../decode/data/D_hat', D_hat)
+
+    # Save the codon mapping as arrays for use in parsing the final library:
+    # the codon keys, the number of codons of every amino acid, the amino
+    # acids in the order of the mapping (-1 padded) and the row of D of the
+    # least degenerate keys (-1 for the others)
+    codon_keys = list(codon_aa_mapping.keys())
+    codon_aa_counts = np.zeros((len(codon_keys), len(aa_idx)), dtype=np.uint8)
+    codon_aa_order = np.full((len(codon_keys), len(aa_idx)), -1, dtype=np.int8)
+    codon_classes = np.full(len(codon_keys), -1, dtype=np.int16)
+
+    for idx, key in enumerate(codon_keys):
+        for order, (aa, count) in enumerate(codon_aa_mapping[key].items()):
+            codon_aa_counts[idx, aa_idx.index(aa)] = count
+            codon_aa_order[idx, order] = aa_idx.index(aa)
 
-    # Save the codon sets and mapping for use in parsing the final library
-    with open('../data/codons.pickle', 'wb') as codon_file:
-        pickle.dump(D_keys, codon_file)
+    for idx, key_set in enumerate(D_keys):
+        for key in key_set:
+            codon_classes[codon_keys.index(key)] = idx
 
-    with open('../data/codon_aa_mapping.pickle', 'wb') as codon_file:
-        pickle.dump(codon_aa_mapping, codon_file)
-    
\ No newline at end of file
+    np.save('../decode/data/codon_keys', np.array(codon_keys, dtype='S3'))
+    np.save('../decode/data/codon_aa_counts', codon_aa_counts)
+    np.save('../decode/data/codon_aa_order', codon_aa_order)
+    np.save('../decode/data/codon_classes', codon_classes)
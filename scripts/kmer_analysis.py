@@ -1,10 +1,12 @@
 import itertools as it
 from tqdm import *
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
 import json
+import math
+import os
 from Bio.Data.CodonTable import standard_dna_table as sdt
-from Bio.Alphabet.IUPAC import IUPACAmbiguousDNA
-from scipy.stats import wasserstein_distance
 import numpy as np
 
 def generate_deg_codon_table():
@@ -83,18 +85,6 @@ def extract_aa_combos_per_position(lib_dict):
     return libs
 
 
-def extract_aa_pos_combos(libs, pos_combos):
-    # Get all of the position/amino acid combinations
-    lib_mers = []
-    for lib in libs:
-        for combo in pos_combos:
-            position_ids = [''.join([key * lib[i][key] for key in lib[i]]) for i in combo]
-            for aas in it.product(*position_ids):
-                lib_mers.append((combo, aas))
-                
-    return lib_mers
-            
-    
 def extract_targets(lib_dict):
     # Extract the target sequences
     target_seqs = []
@@ -112,19 +102,181 @@ def extract_targets(lib_dict):
     return target_seqs
     
     
-def extract_target_kmers(target_seqs, pos_combos):
-    # Get the kmer combinations from the target sequences
-    target_mers = []
-    for seq in target_seqs:
-        for combo in pos_combos:
-            ids = [seq[pos] for pos in combo]
-            target_mers.append((combo, tuple(ids)))
+def elementary_symmetric(values, k):
+    # Sum over all k-combinations of positions of the product of their
+    # values, with Python integers so that large counts cannot overflow
+    e = [1] + [0] * k
+    for v in values:
+        v = int(v)
+        for j in range(k, 0, -1):
+            e[j] += v * e[j - 1]
+            
+    return e[k]
+
+
+def library_counts(libs, positions):
+    # (n_sublibs x n_positions x 256) number of codons of every residue
+    # (by character code) of every sublibrary at the k-mer positions
+    counts = np.zeros((len(libs), len(positions), 256), dtype=np.int64)
+    for s, lib in enumerate(libs):
+        lib = dict(enumerate(lib)) if isinstance(lib, list) else lib
+        for i, pos in enumerate(positions):
+            for aa, count in lib.get(pos, {}).items():
+                counts[s, i, ord(aa)] = count
+                
+    return counts
+
+
+def count_library_kmers(counts, k):
+    # The k-mers of a sublibrary at a position combination are the product
+    # of its residues at those positions, so the number of k-mers with
+    # repeats is a sum of products of the codon counts
+    return sum(elementary_symmetric(c.sum(axis=1), k) for c in counts)
+
+
+def count_distinct_kmers(sets_a, k, sets_b=None):
+    # Number of distinct k-mers of the union of the sublibraries with
+    # residue sets sets_a (or of its intersection with the union of
+    # sets_b), by inclusion-exclusion over the sublibraries: the k-mers
+    # shared by a group of sublibraries are the products of the
+    # intersections of their residue sets
+    if sets_b is None:
+        groups_b = [(1, np.ones(sets_a.shape[1:], dtype=bool))]
+    else:
+        groups_b = [((-1) ** (r + 1), np.logical_and.reduce(sets_b[list(group)]))
+                    for r in range(1, len(sets_b) + 1) for group in it.combinations(range(len(sets_b)), r)]
+    
+    total = 0
+    for r in range(1, len(sets_a) + 1):
+        for group in it.combinations(range(len(sets_a)), r):
+            shared = np.logical_and.reduce(sets_a[list(group)])
+            for sign_b, shared_b in groups_b:
+                total += (-1) ** (r + 1) * sign_b * elementary_symmetric((shared & shared_b).sum(axis=1), k)
+                
+    return total
+
+
+def target_index(targets, positions, k, cache_dir=None, chunk_size=20000):
+    # Sorted distinct target k-mers, each packed into a 64-bit integer as
+    # combination id * n_residues**k + residue code, with the number of
+    # targets that have it. The index only depends on the targets, so it
+    # is saved to cache_dir once per alignment and k
+    chars = np.frombuffer(''.join(targets).encode(), dtype=np.uint8).reshape(len(targets), -1)[:, positions]
+    
+    if cache_dir is not None:
+        digest = hashlib.sha256(chars.tobytes())
+        digest.update(json.dumps([chars.shape, k]).encode())
+        cache_file = os.path.join(cache_dir, '{}.npz'.format(digest.hexdigest()))
+        
+        if os.path.exists(cache_file):
+            with np.load(cache_file) as index:
+                return dict(index)
+    
+    alphabet, codes = np.unique(chars, return_inverse=True)
+    codes = codes.reshape(chars.shape).T.astype(np.int64)
+    n_codes = len(alphabet) ** k
+    
+    if math.comb(len(positions), k) * n_codes >= 2 ** 63:
+        raise ValueError('{}-mers of {} positions do not fit in 64 bits.'.format(k, len(positions)))
+    
+    weights = len(alphabet) ** np.arange(k, dtype=np.int64)
+    kmers, counts = [], []
+    combos = it.combinations(range(len(positions)), k)
+    first = 0
+    
+    while True:
+        combo = np.array(list(it.islice(combos, chunk_size)), dtype=np.int64).reshape(-1, k)
+        if not len(combo):
+            break
             
-    return target_mers
+        # (n_combos x n_targets) packed k-mer of every target. Rows hold
+        # consecutive combination ids, so sorting them sorts the chunk
+        packed = codes[combo[:, 0]] * weights[0] + (first + np.arange(len(combo)))[:, None] * n_codes
+        for j in range(1, k):
+            packed += codes[combo[:, j]] * weights[j]
+            
+        packed = np.sort(packed, axis=1).ravel()
+        starts = np.flatnonzero(np.r_[True, packed[1:] != packed[:-1]])
+        kmers.append(packed[starts])
+        counts.append(np.diff(np.r_[starts, len(packed)]))
+        first += len(combo)
+        
+    index = {'alphabet': alphabet, 'kmers': np.concatenate(kmers), 'counts': np.concatenate(counts)}
+    
+    if cache_dir is not None:
+        # Write to a temporary file first so that an interrupted run never
+        # leaves a partial index in the cache
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_file + '.tmp', 'wb') as f:
+            np.savez(f, **index)
+        os.replace(cache_file + '.tmp', cache_file)
+        
+    return index
 
 
-def proc_gfp_comp(dc_filename, sl_filename, lib_size, sublibs, kmers, target_kmer_dict={},
-                  target_kmer_dict_all={}):
+def count_in_library(index, combos, library_sets, chunk_size=1000000):
+    # Distinct and total target k-mers in the union of the sublibraries of
+    # every library, unpacking every indexed k-mer and testing its residues
+    # against the residue sets of the sublibraries instead of listing
+    # library k-mers
+    alphabet, kmers, counts = index['alphabet'], index['kmers'], index['counts']
+    n_codes = len(alphabet) ** combos.shape[1]
+    
+    # Flat (position, residue) membership table of every sublibrary
+    hits = [sets[:, :, alphabet].reshape(len(sets), -1) for sets in library_sets]
+    
+    in_lib = np.zeros((len(library_sets), 2), dtype=np.int64)
+    for start in range(0, len(kmers), chunk_size):
+        combo_id, code = np.divmod(kmers[start:start + chunk_size], n_codes)
+        combo = combos[combo_id] * len(alphabet)
+        
+        # Flat table index of the residue at every position of every k-mer
+        cells = []
+        for j in range(combos.shape[1]):
+            code, residue = np.divmod(code, len(alphabet))
+            cells.append(combo[:, j] + residue)
+            
+        for l, lib_hits in enumerate(hits):
+            member = np.zeros(len(combo_id), dtype=bool)
+            for hit in lib_hits:
+                in_sublib = hit[cells[0]]
+                for cell in cells[1:]:
+                    in_sublib &= hit[cell]
+                member |= in_sublib
+                
+            in_lib[l] += [np.count_nonzero(member), counts[start:start + chunk_size][member].sum()]
+        
+    return in_lib
+
+
+def compare_kmers(dc_libs, sl_libs, index, positions, k):
+    # Counts of the k-mers of the DeCoDe and SwiftLib libraries and the
+    # targets, and their intersections, in the order of the output columns
+    dc_counts = library_counts(dc_libs, positions)
+    sl_counts = library_counts(sl_libs, positions)
+    dc_sets, sl_sets = dc_counts > 0, sl_counts > 0
+    
+    combos = np.array(list(it.combinations(range(len(positions)), k)), dtype=np.int64).reshape(-1, k)
+    in_lib = count_in_library(index, combos, [dc_sets, sl_sets])
+    
+    return [count_distinct_kmers(dc_sets, k), count_distinct_kmers(sl_sets, k), len(index['kmers']),
+            count_distinct_kmers(dc_sets, k, sl_sets), in_lib[0, 0], in_lib[1, 0],
+            count_library_kmers(dc_counts, k), count_library_kmers(sl_counts, k), int(index['counts'].sum()),
+            in_lib[0, 1], in_lib[1, 1]]
+
+
+def build_target_index(dc_filename, kmers, cache_dir):
+    # Index the target k-mers of a result file ahead of the comparisons
+    with open(dc_filename, 'r') as jsonfile:
+        dc_lib_dict = json.load(jsonfile)
+        
+    targets = extract_targets(dc_lib_dict)
+    
+    for k in kmers:
+        target_index(targets, dc_lib_dict['variable_positions'], k, cache_dir)
+
+
+def proc_gfp_comp(dc_filename, sl_filename, lib_size, sublibs, kmers, cache_dir=None):
     with open(dc_filename, 'r') as jsonfile:
         dc_lib_dict = json.load(jsonfile)
         
@@ -144,64 +296,15 @@ def proc_gfp_comp(dc_filename, sl_filename, lib_size, sublibs, kmers, target_kme
     lines = []
     
     # Loop through analysis for each file pair/kmer combo
-    for k in tqdm(kmers):
-        pos_combos = list(it.combinations(dc_lib_dict['variable_positions'], k))
-        
-        dc_kmers_all = extract_aa_pos_combos(dc_sublibs, pos_combos)
-        sl_kmers_all = extract_aa_pos_combos(sl_sublibs, pos_combos)
+    for k in kmers:
+        index = target_index(targets, dc_lib_dict['variable_positions'], k, cache_dir)
+        counts = compare_kmers(dc_sublibs, sl_sublibs, index, dc_lib_dict['variable_positions'], k)
+        lines.append(base_line.format('gfp', lib_size, sublibs, k, *counts))
         
-        dc_kmers = set(dc_kmers_all)
-        sl_kmers = set(sl_kmers_all)
-        
-        # Let's not repeat ourselves
-        if (k not in target_kmer_dict) or (k not in target_kmer_dict_all):
-            target_kmer_dict_all[k] = extract_target_kmers(targets, pos_combos)
-            target_kmer_dict[k] = set(target_kmer_dict_all[k])
-        
-        target_kmers_all = target_kmer_dict_all[k]
-        target_kmers = target_kmer_dict[k]
-        
-        # Get the size of the set intersections for all combinations
-        DCiSL = len(dc_kmers.intersection(sl_kmers))
-        DCiT = len(dc_kmers.intersection(target_kmers))
-        SLiT = len(sl_kmers.intersection(target_kmers))
-        
-        # Count weighted scores
-        target_counts = Counter(target_kmers_all)
-        
-        DCiT_all = sum([target_counts[kmer] for kmer in dc_kmers])
-        SLiT_all = sum([target_counts[kmer] for kmer in sl_kmers])
-        
-        # Wasserstein distances
-#         dc_wass_kmers = list(target_kmers.union(dc_kmers))
-#         sl_wass_kmers = list(target_kmers.union(sl_kmers))
-        
-#         DC_kmer_counts = Counter(dc_kmers_all)
-#         SL_kmer_counts = Counter(sl_kmers_all)
-        
-#         target_dc_kmer_spectrum = np.array([target_counts[k] for k in dc_wass_kmers])
-#         target_dc_kmer_spectrum = target_dc_kmer_spectrum / np.sum(target_dc_kmer_spectrum)
-#         dc_kmer_spectrum = np.array([DC_kmer_counts[k] for k in dc_wass_kmers])
-#         dc_kmer_spectrum = dc_kmer_spectrum / np.sum(dc_kmer_spectrum)
-        
-#         target_sl_kmer_spectrum = np.array([target_counts[k] for k in sl_wass_kmers])
-#         target_sl_kmer_spectrum = target_sl_kmer_spectrum / np.sum(target_sl_kmer_spectrum)
-#         sl_kmer_spectrum = np.array([SL_kmer_counts[k] for k in sl_wass_kmers])
-#         sl_kmer_spectrum = sl_kmer_spectrum / np.sum(sl_kmer_spectrum)
-        
-#         wass_DC_T = wasserstein_distance(dc_kmer_spectrum, target_dc_kmer_spectrum)
-#         wass_SL_T = wasserstein_distance(sl_kmer_spectrum, target_sl_kmer_spectrum)
-        
-        # Add output line to list
-        lines.append(base_line.format('gfp', lib_size, sublibs, k,
-                                      len(dc_kmers), len(sl_kmers), len(target_kmers),
-                                      DCiSL, DCiT, SLiT, len(dc_kmers_all), len(sl_kmers_all),
-                                      len(target_kmers_all), DCiT_all, SLiT_all))
-        
-    return target_kmer_dict, target_kmer_dict_all, lines
+    return lines
 
 
-def extract_sl_p1sol2(k):
+def extract_sl_p1sol2():
     # Solution from SwiftLib Problem 1 DP Sol. 2    
     sl_p1_sol2 = [
         ['VNS'],
@@ -215,37 +318,27 @@ def extract_sl_p1sol2(k):
         ['VNS']
     ]
 
-    pos_combos = list(it.combinations([187, 188, 190, 191, 192, 196, 257, 258, 259], k))
-    pos_combos_renum = list(it.combinations(list(range(9)), k))
-
-    sl_p1_sol2 = [list(i) for i in sl_p1_sol2]
+    positions = [187, 188, 190, 191, 192, 196, 257, 258, 259]
     
-    solution = []
+    solution = {}
     
-    for pos in sl_p1_sol2:
+    for pos, codons in zip(positions, sl_p1_sol2):
         aas = Counter()
-        for codon in pos:
+        for codon in codons:
             aas += codon_table[codon]
             
-        solution.append(''.join([key * value for key, value in aas.items()]))
+        solution[pos] = aas
 
-    sl_mers = []
+    return [solution]
 
-    for num in range(len(pos_combos)):
-        combo = pos_combos_renum[num]
-        position_ids = [solution[i] for i in combo]
-        for aas in it.product(*position_ids):
-            sl_mers.append((pos_combos[num], aas))
 
-    return sl_mers
-
-
-def proc_rosetta_comp(dc_filename, kmers):
+def proc_rosetta_comp(dc_filename, kmers, cache_dir=None):
     with open(dc_filename, 'r') as jsonfile:
         dc_lib_dict = json.load(jsonfile)
 
     # Process DeCoDe kmers
     dc_sublibs = extract_aa_combos_per_position(dc_lib_dict)
+    sl_sublibs = extract_sl_p1sol2()
 
     # Get targets
     targets = extract_targets(dc_lib_dict)
@@ -256,54 +349,10 @@ def proc_rosetta_comp(dc_filename, kmers):
     lines = []
 
     # Loop through analysis for each file pair/kmer combo
-    for k in tqdm(kmers):
-        pos_combos = list(it.combinations(dc_lib_dict['variable_positions'], k))
-        
-        dc_kmers_all = extract_aa_pos_combos(dc_sublibs, pos_combos)
-        sl_kmers_all = extract_sl_p1sol2(k)
-        
-        dc_kmers = set(dc_kmers_all)
-        sl_kmers = set(sl_kmers_all)
-        
-        target_kmers_all = extract_target_kmers(targets, pos_combos)
-        target_kmers = set(target_kmers_all)
-        
-        # Get the size of the set intersections for all combinations
-        DCiSL = len(dc_kmers.intersection(sl_kmers))
-        DCiT = len(dc_kmers.intersection(target_kmers))
-        SLiT = len(sl_kmers.intersection(target_kmers))
-        
-        # Count weighted scores
-        target_counts = Counter(target_kmers_all)
-        
-        DCiT_all = sum([target_counts[kmer] for kmer in dc_kmers])
-        SLiT_all = sum([target_counts[kmer] for kmer in sl_kmers])
-        
-        # Wasserstein distances
-#         dc_wass_kmers = list(target_kmers.union(dc_kmers))
-#         sl_wass_kmers = list(target_kmers.union(sl_kmers))
-        
-#         DC_kmer_counts = Counter(dc_kmers_all)
-#         SL_kmer_counts = Counter(sl_kmers_all)
-        
-#         target_dc_kmer_spectrum = np.array([target_counts[k] for k in dc_wass_kmers])
-#         target_dc_kmer_spectrum = target_dc_kmer_spectrum / np.sum(target_dc_kmer_spectrum)
-#         dc_kmer_spectrum = np.array([DC_kmer_counts[k] for k in dc_wass_kmers])
-#         dc_kmer_spectrum = dc_kmer_spectrum / np.sum(dc_kmer_spectrum)
-        
-#         target_sl_kmer_spectrum = np.array([target_counts[k] for k in sl_wass_kmers])
-#         target_sl_kmer_spectrum = target_sl_kmer_spectrum / np.sum(target_sl_kmer_spectrum)
-#         sl_kmer_spectrum = np.array([SL_kmer_counts[k] for k in sl_wass_kmers])
-#         sl_kmer_spectrum = sl_kmer_spectrum / np.sum(sl_kmer_spectrum)
-        
-#         wass_DC_T = wasserstein_distance(dc_kmer_spectrum, target_dc_kmer_spectrum)
-#         wass_SL_T = wasserstein_distance(sl_kmer_spectrum, target_sl_kmer_spectrum)
-        
-        # Add output line to list
-        lines.append(base_line.format('1xbi', 320000000, 4, k,
-                                      len(dc_kmers), len(sl_kmers), len(target_kmers),
-                                      DCiSL, DCiT, SLiT, len(dc_kmers_all), len(sl_kmers_all),
-                                      len(target_kmers_all), DCiT_all, SLiT_all))
+    for k in kmers:
+        index = target_index(targets, dc_lib_dict['variable_positions'], k, cache_dir)
+        counts = compare_kmers(dc_sublibs, sl_sublibs, index, dc_lib_dict['variable_positions'], k)
+        lines.append(base_line.format('1xbi', 320000000, 4, k, *counts))
 
     return lines
 
@@ -317,10 +366,12 @@ if __name__ == '__main__':
     # List the kmers to analyze
     kmers = [2, 3, 4]
     
+    # Target k-mer indexes are saved here and shared between the
+    # comparisons of the same alignment
+    cache_dir = 'results/sl_comparison/kmer_index'
+    
     # Process 1xbi Rosetta experiment
     rosetta_file = 'results/sl_comparison/ilp/1xbi_320000000_4.json'
-
-    all_lines.extend(proc_rosetta_comp(rosetta_file, kmers))
     
     # Process GFP experiments
     filename_blanks = [
@@ -330,20 +381,23 @@ if __name__ == '__main__':
 
     filename_combos = list(it.product(*filename_blanks))
     gfp_files_base = 'results/sl_comparison/{}/gfp_239_{}_{}.json'
-
-    target_kmer_dict = {}
-    target_kmer_dict_all = {}
-
-    for fn in tqdm(filename_combos):
-        lib_size = fn[0]
-        lib_count = fn[1]
-
-        dc_filename = gfp_files_base.format('ilp', *fn)
-        sl_filename = gfp_files_base.format('sl', *fn)
-
-        target_kmer_dict, target_kmer_dict_all, comp_lines = proc_gfp_comp(dc_filename, sl_filename, lib_size,
-                                                 lib_count, kmers, target_kmer_dict, target_kmer_dict_all)
-        all_lines.extend(comp_lines)
+    
+    # Build the target indexes before the comparisons that share them
+    build_target_index(rosetta_file, kmers, cache_dir)
+    for fn in filename_combos:
+        build_target_index(gfp_files_base.format('ilp', *fn), kmers, cache_dir)
+    
+    # Compare the file pairs in parallel, keeping the output in order
+    with ProcessPoolExecutor() as pool:
+        futures = [pool.submit(proc_rosetta_comp, rosetta_file, kmers, cache_dir)]
+        
+        for lib_size, lib_count in filename_combos:
+            dc_filename = gfp_files_base.format('ilp', lib_size, lib_count)
+            sl_filename = gfp_files_base.format('sl', lib_size, lib_count)
+            futures.append(pool.submit(proc_gfp_comp, dc_filename, sl_filename, lib_size, lib_count, kmers, cache_dir))
+            
+        for future in tqdm(futures):
+            all_lines.extend(future.result())
         
     # Write output to file
     with open('results/sl_comparison/kmers.csv', 'w') as f:
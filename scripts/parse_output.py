@@ -44,6 +44,18 @@ def read_time(filename):
     return (t, mem)
             
 
+# Read the run time and peak memory (in kB) from the profile in the output
+# file, falling back to the GNU time file for runs without --profile
+def read_usage(filename):
+    with open(filename + '.json', 'r') as json_file:
+        data = json.load(json_file)
+
+    if 'profile' not in data:
+        return read_time(filename + '.time')
+
+    return (data['profile']['total_time'], data['profile']['peak_rss_mb'] * 1024)
+
+
 # Parse log file
 def read_log(filename):
     with open(filename, 'r') as handle:
@@ -73,6 +85,22 @@ def read_log(filename):
     return data
 
 
+# Read the solver progress recorded in the output file, in the columns of
+# read_log, falling back to the log file for older output files. The gap is
+# NA (None) without an incumbent or while it is 0
+def read_progress(filename):
+    with open(filename + '.json', 'r') as json_file:
+        data = json.load(json_file)
+
+    if 'progress' not in data:
+        return read_log(filename + '.log')
+
+    return [[point['incumbent'] if point['incumbent'] is not None else 'NA',
+             point['bound'] if point['bound'] is not None else 'NA',
+             100 * point['gap'] if point['gap'] is not None else 'NA',
+             point['time']] for point in data['progress']]
+
+
 if __name__ == '__main__':
     
     # Handle SwiftLib comparison datasets
@@ -94,7 +122,7 @@ if __name__ == '__main__':
             method = 'SwiftLib'
         
         out = read_output(filename + '.json')
-        time = read_time(filename + '.time')
+        time = read_usage(filename)
         
         data_line = [method, i[1], i[2], out[0], out[1], time[0], time[1]]
         
@@ -119,8 +147,8 @@ if __name__ == '__main__':
         method = 'DeCoDe'
         
         out = read_output(filename + '.json')
-        time = read_time(filename + '.time')
-        log = read_log(filename + '.log')
+        time = read_usage(filename)
+        log = read_progress(filename)
         
         for array in log:
             array.insert(0, i)
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from scipy import sparse
+from decode.backends import read_model, write_model
+
+inf = np.inf
+
+
+def small_model():
+    # Every row type, two ranged rows, a row longer than a line of an LP
+    # file, and integer, continuous, fixed, free and unused columns
+    n_cols = 15
+    A = np.zeros((5, n_cols))
+    A[0, :3] = [1, -2.5, 0.1]
+    A[1, 2:5] = [3, 1, -1]
+    A[2, [0, 5]] = [1, 1]
+    A[3, :14] = 0.3 * np.arange(1, 15)
+    A[4, [6, 7]] = [-1e-7, 2]
+
+    c = np.zeros(n_cols)
+    c[[0, 1, 5, 8]] = [1, -2, 0.5, 3]
+
+    col_lb = np.zeros(n_cols)
+    col_ub = np.ones(n_cols)
+    col_lb[9], col_ub[9] = -inf, inf
+    col_lb[10], col_ub[10] = -3, 4
+    col_lb[11], col_ub[11] = 2, 2
+    col_ub[12] = inf
+    col_ub[13] = 7.5
+
+    return {
+        'A': sparse.csr_matrix(A),
+        'row_lb': np.array([2, -inf, 1, -5, -3.5]),
+        'row_ub': np.array([2, 4, inf, 10.25, 1]),
+        'c': c,
+        'col_lb': col_lb,
+        'col_ub': col_ub,
+        'integrality': np.array([1] * 8 + [0, 0, 1, 0, 0, 0, 1])
+    }
+
+
+def read_back(arrays, filename):
+    # Write and read the model, with the columns in the order of their names
+    write_model(arrays, filename)
+    read, names = read_model(filename)
+
+    assert sorted(names) == sorted('x{}'.format(j) for j in range(arrays['A'].shape[1]))
+    order = np.argsort([int(name[1:]) for name in names])
+
+    return dict(read, A=read['A'].tocsc()[:, order],
+                **{key: read[key][order] for key in ['c', 'col_lb', 'col_ub', 'integrality']})
+
+
+def assert_same_columns(read, arrays):
+    for key in ['c', 'col_lb', 'col_ub', 'integrality']:
+        np.testing.assert_array_equal(read[key], arrays[key], err_msg=key)
+
+
+@pytest.mark.parametrize('name', ['model.mps', 'model.mps.gz'])
+def test_mps_round_trip(tmp_path, name):
+    arrays = small_model()
+    read = read_back(arrays, str(tmp_path / name))
+
+    np.testing.assert_array_equal(read['A'].toarray(), arrays['A'].toarray())
+    np.testing.assert_array_equal(read['row_lb'], arrays['row_lb'])
+    np.testing.assert_array_equal(read['row_ub'], arrays['row_ub'])
+    assert_same_columns(read, arrays)
+
+
+@pytest.mark.parametrize('name', ['model.lp', 'model.lp.gz'])
+def test_lp_round_trip(tmp_path, name):
+    # The ranged rows 3 and 4 are split into a lower and an upper row
+    arrays = small_model()
+    read = read_back(arrays, str(tmp_path / name))
+
+    rows = [0, 1, 2, 3, 3, 4, 4]
+    np.testing.assert_array_equal(read['A'].toarray(), arrays['A'].toarray()[rows])
+    np.testing.assert_array_equal(read['row_lb'], [2, -inf, 1, -5, -inf, -3.5, -inf])
+    np.testing.assert_array_equal(read['row_ub'], [2, 4, inf, inf, 10.25, inf, 1])
+    assert_same_columns(read, arrays)
+
+
+def test_lp_long_rows(tmp_path):
+    # The 14 terms of row 3 are written ten to a line
+    filename = str(tmp_path / 'model.lp')
+    write_model(small_model(), filename)
+
+    with open(filename) as handle:
+        lines = handle.read().split('\n')
+
+    start = next(k for k, line in enumerate(lines) if line.startswith(' r3_lo:'))
+    assert lines[start].count(' x') == 10
+    assert lines[start + 1].count(' x') == 4
@@ -0,0 +1,22 @@
+import os
+import numpy as np
+import pytest
+from decode.ilp import solve_library, solve_model
+from decode.seq_utils import create_O, process_msa
+
+EXAMPLE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'examples', 'fig1', '6o_test-1.aln')
+
+
+@pytest.mark.parametrize('name', ['model.mps', 'model.lp'])
+def test_exported_model(tmp_path, name):
+    # Solving an exported two-template model gives the same number of
+    # covered targets as solving it directly
+    n_targets, n_var_pos, O = create_O(process_msa(EXAMPLE)[2])
+    filename = str(tmp_path / name)
+
+    direct = solve_library(O, 24, 2, bins=20, verbose=False, solver='highs', export=filename)
+    solution, column_map = solve_model(filename, solver='highs', verbose=False)
+
+    assert solution['objective'] == direct['objective']
+    assert np.sum(solution['binary_coverage']) == solution['objective']
+    assert column_map['n_columns'] == direct['model_size']['columns']